@@ -128,6 +128,12 @@ if sys.platform.startswith('win'):
     from .data_acquisition_units import NI_9215
     daq = NI_9215()
     logger.info("daq = " + daq.identify())
+elif os.getenv('SIMULATED_DAQ'):
+    # Load a simulated DAQ, e.g. for testing without hardware. The variable
+    # is the seed of the simulation.
+    from .data_acquisition_units import MockDAQ
+    daq = MockDAQ(seed=int(os.getenv('SIMULATED_DAQ')))
+    logger.info("daq = " + daq.identify())
 
 # Load a Gyro if defined in environment variable
 #
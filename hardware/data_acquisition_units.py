@@ -14,44 +14,571 @@ try:
     from PyDAQmx import *
 except:
     print("It seems that niDAQmx is not installed on this system.")
+    # Let the module load without niDAQmx, so that MockDAQ can be used. The
+    # constants are those of NIDAQmx.h.
+    from ctypes import c_int32 as int32
+    Task = object
+    DAQmx_Val_Rising = 10280
+    DAQmx_Val_Falling = 10171
+    DAQmx_Val_ContSamps = 10123
+    DAQmx_Val_FiniteSamps = 10178
+    DAQmx_Val_Cfg_Default = -1
+    DAQmx_Val_Volts = 10348
+    DAQmx_Val_GroupByChannel = 0
+    DAQmx_Val_GroupByScanNumber = 1
+    DAQmx_Val_Acquired_Into_Buffer = 1
+    DAQmx_Val_Task_Commit = 3
+    DAQmx_Val_Task_Unreserve = 5
 import numpy
 import ctypes
 from ctypes import byref
-import queue
+import threading
+import asyncio
 import time
+import math
+from collections import OrderedDict
 from hardware import u
-import random
 
 
-class MockDAQ:
+class BufferPool:
     """
-    This class acts as a dummy version of the NI 9215 DAQ
+    Hands out preallocated arrays of a single shape, and takes them back for
+    reuse, so that a continuous acquisition does not allocate a new array for
+    every chunk.
 
     Parameters:
-        instr_name (str, optional): The name of the instrument
+        shape (tuple): The shape of the arrays.
+        reuse (bool): If false, every array is newly allocated and
+            :meth:`release` does nothing.
 
     Attributes:
-        name (str): The DAQ name
-        data (list): A list of random ints between 0 and 9
+        allocations (int): The number of arrays allocated so far.
     """
+    def __init__(self, shape, reuse=True):
+        self.shape = shape
+        self.reuse = reuse
+        self.allocations = 0
+        self._free = []
+        self._owned = dict()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Returns a free array, allocating one if none are free."""
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+            self.allocations += 1
+        buf = numpy.empty(self.shape)
+        if self.reuse:
+            self._owned[id(buf)] = buf
+        return buf
+
+    def release(self, chunk):
+        """
+        Returns an array, or a view of one, to the pool. The caller must not
+        use it afterwards.
+        """
+        if not self.reuse:
+            return
+        while chunk is not None and id(chunk) not in self._owned:
+            chunk = chunk.base
+        if chunk is not None:
+            with self._lock:
+                self._free.append(chunk)
 
-    def __init__(self, instr_name = None):
-        if not instr_name:
-            self.name = "DAQ -NI9215 "
-        else:
-            self.name = instr_name
 
-    def identify(self):
-        return self.name
+class BufferOverrunError(Exception):
+    """Raised when a :class:`RingBuffer` with the ``'error'`` policy fills."""
+    pass
 
-    def read(self, rate = 5, timeout = 5):
-        self.data = list()
-        for x in range(0, rate*timeout):
-            self.data.append(random.randint(0, 10))
-        return self.data
 
-    def stop(self):
-        print("Stopped")
+class RingBuffer:
+    """
+    A fixed-capacity buffer of data chunks, passed from the DAQ callback to a
+    consumer.
+
+    When the buffer is full, the ``policy`` decides what happens to a new
+    chunk:
+
+    - ``'block'`` - wait until the consumer makes room. The DAQ keeps
+      acquiring into its own buffer in the meantime.
+    - ``'drop-oldest'`` - discard the oldest chunk to make room.
+    - ``'error'`` - discard the new chunk, and raise a
+      :class:`BufferOverrunError` in the consumer.
+
+    Iterating over the buffer yields chunks until :meth:`close` is called and
+    the remaining chunks have been consumed.
+
+    Parameters:
+        capacity (int): The number of chunks the buffer holds.
+        policy (str): One of ``'block'``, ``'drop-oldest'`` or ``'error'``.
+        release (callable, optional): Called with each chunk once it has been
+            discarded, or once the consumer has moved on to the next chunk,
+            e.g. :meth:`BufferPool.release`.
+
+    Attributes:
+        lost (int): The number of samples per channel that were discarded.
+        overruns (int): The number of chunks that were discarded.
+    """
+    policies = ('block', 'drop-oldest', 'error')
+
+    def __init__(self, capacity=16, policy='block', release=None):
+        if policy not in self.policies:
+            raise ValueError(
+                "Overrun policy must be one of %s" % (self.policies,))
+        self.capacity = capacity
+        self.policy = policy
+        self.release = release
+        self.lost = 0
+        self.overruns = 0
+        self.closed = False
+
+        self._slots = [None] * capacity
+        self._head = 0
+        self._size = 0
+        self._error = None
+        self._error_after = 0
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        return self._size
+
+    def put(self, chunk):
+        """
+        Adds a chunk to the buffer, applying the overrun policy if it is full.
+
+        Returns:
+            bool: ``True`` if the chunk was stored.
+        """
+        with self._condition:
+            if self.policy == 'block':
+                while self._size == self.capacity and not self.closed:
+                    self._condition.wait()
+            if self.closed:
+                return False
+
+            if self._size == self.capacity:
+                self.overruns += 1
+                if self.policy == 'error':
+                    self.lost += chunk.shape[-1]
+                    self._release(chunk)
+                    if self._error is None:
+                        # Raise once the chunks before the gap are consumed
+                        self._error = BufferOverrunError(
+                            "Samples lost after a buffer overrun")
+                        self._error_after = self._size
+                    return False
+                # drop-oldest
+                self.lost += self._slots[self._head].shape[-1]
+                self._release(self._slots[self._head])
+                self._slots[self._head] = None
+                self._head = (self._head + 1) % self.capacity
+                self._size -= 1
+
+            tail = (self._head + self._size) % self.capacity
+            self._slots[tail] = chunk
+            self._size += 1
+            self._condition.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        """
+        Removes and returns the oldest chunk, waiting for one if the buffer is
+        empty.
+
+        Args:
+            timeout (float, optional): The maximum time to wait in seconds.
+
+        Returns:
+            The oldest chunk, or ``None`` once the buffer is closed and empty.
+
+        Raises:
+            BufferOverrunError: If a chunk was lost under the ``'error'``
+                policy.
+            TimeoutError: If no chunk arrived within ``timeout`` seconds.
+        """
+        with self._condition:
+            if not self._condition.wait_for(
+                    lambda: self._size or self.closed or (
+                        self._error is not None and not self._error_after),
+                    timeout):
+                raise TimeoutError("No data within %f seconds." % timeout)
+            if self._error is not None:
+                if not self._error_after:
+                    error, self._error = self._error, None
+                    raise error
+                self._error_after -= 1
+            if not self._size:
+                return None
+
+            chunk = self._slots[self._head]
+            self._slots[self._head] = None
+            self._head = (self._head + 1) % self.capacity
+            self._size -= 1
+            self._condition.notify_all()
+            return chunk
+
+    def close(self):
+        """Signals the end of the stream, and releases any blocked callers."""
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+    def _release(self, chunk):
+        if self.release is not None:
+            self.release(chunk)
+
+    def __iter__(self):
+        while True:
+            chunk = self.get()
+            if chunk is None:
+                return
+            yield chunk
+            # The consumer has asked for the next chunk
+            self._release(chunk)
+
+
+class SampleClock:
+    """
+    Maps the sample indices of an acquisition onto the host's
+    ``time.monotonic()`` clock, and back, so that events from other
+    instruments can be lined up with the data.
+
+    Each time samples are read, :meth:`update` is given the number of raw
+    samples acquired so far and the host time at which they were available.
+    A line is fitted through these points with a running (Welford)
+    regression, so the DAQ sample rate is measured against the host clock,
+    and drift between the two is corrected. The times include the mean
+    latency of the callbacks.
+
+    Parameters:
+        rate (float): The nominal raw sample rate, used until two points
+            have been recorded.
+        ratio (int): The decimation ratio. Indices are decimated samples.
+        delay (float): The delay of the decimator in raw samples.
+
+    Attributes:
+        count (int): The number of points recorded.
+        epoch (float): ``time.time() - time.monotonic()`` when the clock was
+            created, to convert to wall clock time.
+    """
+    def __init__(self, rate, ratio=1, delay=0):
+        self.nominal_rate = rate
+        self.ratio = ratio
+        self.delay = delay
+        self.epoch = time.time() - time.monotonic()
+        self.count = 0
+        self._mean_samples = 0
+        self._mean_time = 0
+        self._covariance = 0
+        self._variance = 0
+
+    def update(self, samples, timestamp):
+        """
+        Records that ``samples`` raw samples had been acquired at the
+        monotonic time ``timestamp``.
+        """
+        self.count += 1
+        delta = samples - self._mean_samples
+        self._mean_samples += delta / self.count
+        self._mean_time += (timestamp - self._mean_time) / self.count
+        self._covariance += delta * (timestamp - self._mean_time)
+        self._variance += delta * (samples - self._mean_samples)
+
+    @property
+    def rate(self):
+        """The raw sample rate measured against the host clock."""
+        if self.count < 2 or not self._covariance:
+            return self.nominal_rate
+        return self._variance / self._covariance
+
+    def time(self, index):
+        """
+        Returns the monotonic time at which the decimated sample ``index``
+        (or array of indices) was acquired.
+        """
+        # A raw sample is acquired as the count passes its index plus one
+        samples = (numpy.asarray(index) * self.ratio + self.ratio
+                   - self.delay)
+        return self._mean_time + (samples - self._mean_samples) / self.rate
+
+    def wall_time(self, index):
+        """As :meth:`time`, but as a ``time.time()`` timestamp."""
+        return self.time(index) + self.epoch
+
+    def index(self, timestamp):
+        """
+        Returns the (fractional) decimated sample index acquired at the
+        monotonic time ``timestamp``, e.g. of a rotation stage event.
+        """
+        samples = (self._mean_samples
+                   + (numpy.asarray(timestamp) - self._mean_time) * self.rate)
+        return (samples + self.delay - self.ratio) / self.ratio
+
+
+class Chunk(numpy.ndarray):
+    """
+    A chunk of data from an asynchronous read: a numpy array, which also
+    records where it belongs in the acquisition.
+
+    Attributes:
+        index (int): The index of the first sample in the acquisition.
+        timestamp (float): The ``time.monotonic()`` time of the callback
+            that completed the chunk.
+        clock (SampleClock): The clock model of the acquisition.
+    """
+    index = None
+    timestamp = None
+    clock = None
+
+    def times(self):
+        """Returns the monotonic time at which each sample was acquired."""
+        return self.clock.time(self.index + numpy.arange(self.shape[-1]))
+
+
+class BoxcarDecimator:
+    """
+    Downsamples by averaging each group of ``ratio`` samples. This is the
+    cheapest decimator, but its frequency response has large sidelobes, so
+    noise above the output Nyquist frequency aliases into the output. It
+    keeps no state between chunks.
+
+    Parameters:
+        ratio (int): The decimation ratio.
+    """
+    def __init__(self, ratio):
+        self.ratio = ratio
+        # The output is centred this many input samples before the last
+        # sample that contributed to it
+        self.delay = (ratio - 1) / 2
+
+    def reset(self):
+        """Forgets the samples seen so far. Not needed for a boxcar."""
+        pass
+
+    def __call__(self, x, out):
+        """
+        Decimates a chunk.
+
+        Args:
+            x (numpy.array): The samples, with one row per channel. The number
+                of samples must be a multiple of ``ratio``.
+            out (numpy.array): The array to write the decimated samples into,
+                with one row per channel.
+        """
+        numpy.add.reduce(
+            x.reshape(x.shape[0], -1, self.ratio), axis=2, out=out)
+        out *= 1 / self.ratio
+
+
+class FIRDecimator:
+    """
+    Downsamples with a lowpass FIR filter. Only every ``ratio``-th output of
+    the filter is computed, as in a polyphase implementation, from a strided
+    view of the input, so the cost per output sample is one dot product of
+    length ``len(taps)``.
+
+    The last ``len(taps) - 1`` samples of each chunk are kept, so consecutive
+    chunks are filtered as one continuous signal. Before the first chunk, the
+    history is filled with the first sample, to avoid a step transient.
+
+    Parameters:
+        ratio (int): The decimation ratio.
+        taps (array, optional): The filter taps. They are normalized to unit
+            gain at DC. If not specified, a Blackman windowed sinc is
+            designed with :meth:`design`.
+        cutoff (float): The cutoff of the designed filter as a fraction of the
+            output Nyquist frequency.
+        taps_per_output (int): The length of the designed filter, in output
+            samples.
+    """
+    def __init__(self, ratio, taps=None, cutoff=.8, taps_per_output=8):
+        self.ratio = ratio
+        if taps is None:
+            taps = self.design(ratio, cutoff, taps_per_output)
+        taps = numpy.asarray(taps, dtype=numpy.float64)
+        self.taps = taps / taps.sum()
+        # The filter is applied as a correlation with the reversed taps
+        self._reversed = self.taps[::-1].copy()
+        self.delay = (len(taps) - 1) / 2
+        self.reset()
+
+    @staticmethod
+    def design(ratio, cutoff=.8, taps_per_output=8):
+        """
+        Returns the taps of a Blackman windowed sinc lowpass filter.
+
+        Args:
+            ratio (int): The decimation ratio.
+            cutoff (float): The cutoff as a fraction of the output Nyquist
+                frequency.
+            taps_per_output (int): The length of the filter, in output
+                samples.
+        """
+        n = taps_per_output * ratio + 1
+        t = numpy.arange(n) - (n - 1) / 2
+        return numpy.sinc(cutoff * t / ratio) * numpy.blackman(n)
+
+    def reset(self):
+        """Forgets the samples seen so far, e.g. before a new acquisition."""
+        self._buffer = None
+
+    def __call__(self, x, out):
+        """
+        Decimates a chunk, continuing from the previous one.
+
+        Args:
+            x (numpy.array): The samples, with one row per channel. The number
+                of samples must be a multiple of ``ratio``.
+            out (numpy.array): The array to write the decimated samples into,
+                with one row per channel.
+        """
+        channels, samples = x.shape
+        history = len(self.taps) - 1
+
+        # The history is kept at the start of the buffer, followed by the
+        # chunk. The buffer is only reallocated if the chunk size changes.
+        buffer = self._buffer
+        if buffer is None or buffer.shape != (channels, history + samples):
+            buffer = numpy.empty((channels, history + samples))
+            if self._buffer is None:
+                buffer[:, :history] = x[:, :1]
+            else:
+                buffer[:, :history] = self._buffer[:, :history]
+            self._buffer = buffer
+        buffer[:, history:] = x
+
+        # Output m is computed from the window of samples ending with input
+        # sample (m + 1) * ratio - 1
+        row, column = buffer.strides
+        windows = numpy.lib.stride_tricks.as_strided(
+            buffer[:, self.ratio - 1:],
+            shape=(channels, samples // self.ratio, len(self.taps)),
+            strides=(row, column * self.ratio, column), writeable=False)
+        numpy.einsum('cnk,k->cn', windows, self._reversed, out=out)
+
+        buffer[:, :history] = buffer[:, samples:]
+
+
+class CICDecimator(FIRDecimator):
+    """
+    Downsamples with a cascaded integrator-comb filter: ``order`` boxcars of
+    length ``ratio`` in series. This rejects the frequencies that alias onto
+    DC much better than a single boxcar, at the cost of some droop in the
+    passband.
+
+    The filter is applied through its equivalent FIR taps, rather than the
+    recursive integrators, whose state grows without bound in floating
+    point.
+
+    Parameters:
+        ratio (int): The decimation ratio.
+        order (int): The number of integrator and comb stages.
+    """
+    def __init__(self, ratio, order=3):
+        self.order = order
+        taps = numpy.ones(1)
+        for _ in range(order):
+            taps = numpy.convolve(taps, numpy.ones(ratio))
+        FIRDecimator.__init__(self, ratio, taps)
+
+
+decimators = {
+    'boxcar': BoxcarDecimator,
+    'cic': CICDecimator,
+    'fir': FIRDecimator,
+}
+
+
+def make_decimator(decimator, ratio):
+    """
+    Returns a new decimator.
+
+    Args:
+        decimator (str, callable): One of the names in ``decimators``, or a
+            decimator class, called with ``ratio``.
+        ratio (int): The decimation ratio.
+    """
+    if isinstance(decimator, str):
+        if decimator not in decimators:
+            raise ValueError(
+                "Decimator must be one of %s" % (tuple(decimators),))
+        decimator = decimators[decimator]
+    return decimator(ratio)
+
+
+def benchmark_decimators(ratio=10, channels=1, samples=2**20, repeat=5):
+    """
+    Measures the throughput of each decimator on random data.
+
+    Args:
+        ratio (int): The decimation ratio.
+        channels (int): The number of channels.
+        samples (int): The number of samples per channel in each chunk.
+        repeat (int): The number of chunks. The fastest is reported.
+
+    Returns:
+        dict: The input samples per second per channel, by decimator name.
+    """
+    samples -= samples % ratio
+    x = numpy.random.randn(channels, samples)
+    out = numpy.empty((channels, samples // ratio))
+    results = dict()
+    for name in decimators:
+        decimator = make_decimator(name, ratio)
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            decimator(x, out)
+            best = min(best, time.perf_counter() - start)
+        results[name] = samples / best
+    return results
+
+
+def _stream_sizes(rate, oversampling_ratio, block_seconds, latency=None,
+                  callback_seconds=None, buffer_seconds=None):
+    """
+    Sizes a continuous acquisition.
+
+    Args:
+        rate (float): The decimated sample rate.
+        oversampling_ratio (int): The decimation ratio.
+        block_seconds (float): The duration of each block delivered to the
+            consumer. It is shortened to ``latency`` if that is given.
+        latency (float, optional): The target delay between a sample being
+            acquired and being delivered.
+        callback_seconds (float, optional): The interval between callbacks.
+            It is shortened so that each block is a whole number of
+            callbacks. Defaults to half of ``latency``, or to 0.1 s.
+        buffer_seconds (float, optional): The depth of the device buffer.
+            Defaults to ten callbacks, or 1 s if that is longer. It is
+            rounded up to a whole number of callbacks.
+
+    Returns:
+        tuple: The raw samples per channel read by each callback, the
+        decimated samples per channel in each block, and the raw samples
+        per channel held by the device buffer.
+    """
+    if latency:
+        block_seconds = min(block_seconds, latency)
+    block_size = max(1, int(block_seconds * rate))
+
+    if callback_seconds is None:
+        callback_seconds = latency / 2 if latency else .1
+    # The number of callbacks per block
+    callbacks = min(block_size, max(1, math.ceil(
+        block_size / max(1, int(callback_seconds * rate)))))
+    while block_size % callbacks:
+        callbacks += 1
+    sample_size = block_size // callbacks * oversampling_ratio
+
+    if buffer_seconds is None:
+        buffer_seconds = max(1, 10 * sample_size / oversampling_ratio / rate)
+    # On USB and DMA devices, DAQmx rejects a buffer that is not a whole
+    # number of callbacks (error -200877)
+    buffer_size = sample_size * max(2, math.ceil(
+        buffer_seconds * rate * oversampling_ratio / sample_size))
+    return sample_size, block_size, buffer_size
 
 
 class NI_9215:
@@ -68,9 +595,15 @@ class NI_9215:
     .. note:: This class will not work unless you have installed ``niDAQmx``
        which is only available on Windows systems.
 
-
+    Synchronous reads keep their tasks configured in a cache, keyed by every
+    setting of the read, so repeating a read only pays for starting and
+    stopping the task. ``task_cache_size`` sets how many tasks are kept; 0
+    disables the cache. Only one task can reserve the device, so only the
+    last one used stays committed. The others are unreserved, and are
+    committed again when reused.
     """
-    def __init__(self, device_name=None, max_voltage=None, rate=None):
+    def __init__(self, device_name=None, max_voltage=None, rate=None,
+                 channels=None, task_cache_size=8):
         if not device_name:
             # Note, this will probably not work if multiple devices exist
             n = 1024
@@ -81,30 +614,108 @@ class NI_9215:
         self.device_name = device_name
         self.rate = rate
         self.max_voltage = max_voltage
+        self.channels = channels
         self.task = None
+        self.task_cache_size = task_cache_size
+        self._task_cache = OrderedDict()
+        # The cached task that holds the device reservation
+        self._reserved_task = None
+
+    async def astream(self, rate=None, chunk_seconds=1, max_voltage=None,
+                      oversampling_ratio=10, channels=None,
+                      interleaved=False, buffer_chunks=16, overrun='block',
+                      reuse_buffers=False, decimator='boxcar',
+                      latency=None, callback_seconds=None,
+                      buffer_seconds=None):
+        """
+        Streams data continuously into an asyncio event loop.
 
-    # define two different read functions, one async and one sync
-    """
-    async def read(self, seconds, rate=None, max_voltage=None, timeout=0,
-             verbose=False, oversampling_ratio=10, task_name=""):
-        rate = self._get_rate(rate, oversampling_ratio)
-        max_voltage = self._get_max_voltage(max_voltage)
-
-
-        self.task = self.FOG_DAQ_Task(
-            self, seconds, rate, oversampling_ratio, max_voltage, asynchronous)
-
-        self.queue = asyncio.Queue()
-        # self.task.StartTask()
-        # while True:
-        #     yield (await self.queue.get())
+        The DAQmx callback stores each chunk in a :class:`RingBuffer`, as for
+        an asynchronous :meth:`read`, and wakes the event loop with
+        ``call_soon_threadsafe``, so acquisition can share a single loop with
+        other instruments without any polling threads.
 
+        >>> async for chunk in daq.astream(rate=100, chunk_seconds=.1):
+        ...     process(chunk)
 
-    """
+        Parameters
+        ----------
+        rate, max_voltage, oversampling_ratio, channels, interleaved, decimator
+            As for :meth:`read`.
+        buffer_chunks, overrun, latency, callback_seconds, buffer_seconds
+            As for :meth:`read`, with lost chunks counted in ``queue``.
+            Under the ``'block'`` policy only the DAQ callback waits, never
+            the event loop.
+        reuse_buffers : bool
+            As for :meth:`read`. Each chunk is reused once the next one is
+            requested.
+        chunk_seconds : int, float
+            The duration of each chunk in seconds, unless ``latency`` is
+            shorter.
+
+        Yields
+        ------
+        Chunk
+            Chunks of data in volts, shaped as for :meth:`read`, as arrays
+            like the asynchronous generator of :meth:`read`. The stream ends
+            when :meth:`stop` is called.
+        """
+        rate = self._get_rate(rate, oversampling_ratio)
+        max_voltage = self._get_max_voltage(max_voltage)
+        channels = self._get_channels(channels)
+
+        # The running loop, as get_running_loop() needs Python 3.7
+        loop = asyncio.get_event_loop()
+        queue = self.queue = RingBuffer(buffer_chunks, overrun)
+        ready = asyncio.Event()
+
+        def sink(chunk):
+            # Runs in the DAQmx callback thread
+            queue.put(chunk)
+            loop.call_soon_threadsafe(ready.set)
+
+        def close():
+            queue.close()
+            loop.call_soon_threadsafe(ready.set)
+
+        self._close_stream = close
+        self._unreserve_tasks()
+        task = self.task = self.FOG_DAQ_Task(
+            self, chunk_seconds, rate, oversampling_ratio, max_voltage, True,
+            channels, interleaved, sink, reuse_buffers,
+            decimator=decimator, latency=latency,
+            callback_seconds=callback_seconds, buffer_seconds=buffer_seconds)
+        self.pool = task.pool
+        self.clock = task.clock
+        queue.release = self.pool.release
+        task.StartTask()
+
+        try:
+            while True:
+                try:
+                    chunk = queue.get(timeout=0)
+                except TimeoutError:
+                    # Chunks stored after the clear also set the event, as
+                    # the loop runs the callbacks only once this task waits
+                    ready.clear()
+                    await ready.wait()
+                    continue
+                if chunk is None:
+                    return
+                yield chunk
+                task.pool.release(chunk)
+        finally:
+            # Stop the task if the consumer stopped iterating early
+            if self.task is task:
+                self.stop()
 
     def read(self, seconds, rate=None, max_voltage=None, timeout=0,
              verbose=False, oversampling_ratio=10, task_name="",
-             asynchronous=False):
+             asynchronous=False, channels=None, interleaved=False,
+             buffer_chunks=16, overrun='block', reuse_buffers=False,
+             chunk_seconds=1, decimator='boxcar', latency=None,
+             callback_seconds=None, buffer_seconds=None, trigger=None,
+             trigger_edge='rising', pretrigger_seconds=0):
 
         """
         Parameters
@@ -134,7 +745,7 @@ class NI_9215:
         oversampling_ratio : int
             If N samples of the same quantity are taken, each with
             uncorrelated errors, averaging these values will reduce the noise
-            by a factor of :math:`\sqrt{N}`. By default, the output rate of
+            by a factor of :math:`\\sqrt{N}`. By default, the output rate of
             the data returned by 'read' is 1/10 the bandwidth of the lock-in
             amplifier. We can reduce our noise to a theoretical limit by sampling
             at the lock-in amplifier bandwidth, and then downsampling via simple
@@ -147,60 +758,238 @@ class NI_9215:
             be fetched in groups of chunk_sizes (specified by seconds and
             rate) by using the ``next(g)`` syntax. This function will return
             a generator instead of an array.
+        channels : int, list of int
+            The analog input channel, or a list of channels to sample
+            simultaneously. If not specified, will default to the channels
+            given when the DAQ was created, or to channel 0.
+        interleaved : bool
+            If set to ``True``, samples are transferred interleaved by scan
+            rather than grouped by channel. The returned data is the same
+            either way.
+        buffer_chunks : int
+            In asynchronous mode, the number of chunks that can wait for the
+            consumer before the ``overrun`` policy applies.
+        overrun : str
+            In asynchronous mode, what to do when the consumer falls behind.
+            One of ``'block'``, ``'drop-oldest'`` or ``'error'``. See
+            :class:`RingBuffer`.
+        reuse_buffers : bool
+            In asynchronous mode, if set to ``True``, the arrays yielded by the
+            generator come from a :class:`BufferPool` and are reused once the
+            next chunk is requested, so no memory is allocated once the
+            acquisition is running. Copy a chunk to keep it.
+        chunk_seconds : int, float
+            Synchronous reads longer than this are acquired and decimated in
+            chunks of this duration, so the raw data held in memory does not
+            grow with ``seconds``.
+        decimator : str
+            How the oversampled readings are downsampled. One of
+            ``'boxcar'`` (default), ``'cic'`` or ``'fir'``, or a decimator
+            class. The boxcar averages each group of readings, which lets
+            noise above the output Nyquist frequency alias into the data.
+            The CIC and FIR decimators filter it out, and carry their state
+            from one chunk to the next. See :func:`benchmark_decimators` for
+            their cost.
+        latency : float
+            In asynchronous mode, the target delay in seconds between a
+            sample being acquired and its chunk being yielded, e.g. 0.05 for
+            a live display. Chunks are shortened to this duration if
+            ``seconds`` is longer, and ``callback_seconds`` and
+            ``buffer_seconds`` are sized from it.
+        callback_seconds : float
+            In asynchronous mode, how often the DAQ callback reads and
+            decimates the samples acquired so far. Each chunk is assembled
+            from a whole number of callbacks. Defaults to half the latency,
+            or to 0.1 s.
+        buffer_seconds : float
+            In asynchronous mode, the depth of the device buffer, which
+            holds samples until the next callback reads them. Defaults to
+            ten callbacks, or 1 s if that is longer, so a late callback does
+            not overrun the device.
+        trigger : str
+            A digital terminal, e.g. ``'/cDAQ1/PFI0'``. If given, the
+            acquisition starts at an edge on this terminal, rather than as
+            soon as the task starts.
+        trigger_edge : str
+            ``'rising'`` (default) or ``'falling'``.
+        pretrigger_seconds : float
+            In synchronous mode, the duration of data to keep from before
+            the trigger edge, which is used as a reference trigger. The data
+            then covers ``pretrigger_seconds`` before the edge and
+            ``seconds`` after it, and ``trigger_index`` is the index of the
+            first sample after the edge.
 
         Returns
         -------
         numpy.array
-            A one-dimensional numpy array of the data.
+            A one-dimensional numpy array of the data if ``channels`` is a
+            scalar, otherwise a two-dimensional array with one row per
+            channel, even for a list of one channel.
         generator
             If asynchronous is set to true, a generator will be returned.
             Using the ``next(g)`` syntax will yield a chunk of data of size
-            rate * seconds
+            rate * seconds. The generator finishes once ``stop()`` is called
+            and the buffered chunks have been consumed. Each chunk is a
+            :class:`Chunk`, which records the index of its first sample and
+            the time it was read.
+
+        After a read, ``clock`` is the :class:`SampleClock` of the
+        acquisition, which maps sample indices onto ``time.monotonic()``.
         """
         rate = self._get_rate(rate, oversampling_ratio)
         max_voltage = self._get_max_voltage(max_voltage)
+        channels = self._get_channels(channels)
 
-        self.task = self.FOG_DAQ_Task(
-            self, seconds, rate, oversampling_ratio, max_voltage, asynchronous)
+        if trigger_edge not in ('rising', 'falling'):
+            raise ValueError("Trigger edge must be 'rising' or 'falling'")
+        if pretrigger_seconds and not trigger:
+            raise ValueError("Pretrigger samples need a trigger")
+        if pretrigger_seconds and asynchronous:
+            raise ValueError(
+                "Pretrigger samples are only available in synchronous mode")
 
         # a bunch of gymnastics to be able to return two different data types
         # basically bad practice, rewrite
         if asynchronous:
-            self.queue = queue.Queue()
+            self.queue = RingBuffer(buffer_chunks, overrun)
+            self._close_stream = self.queue.close
+            self._unreserve_tasks()
+            self.task = self.FOG_DAQ_Task(
+                self, seconds, rate, oversampling_ratio, max_voltage, True,
+                channels, interleaved, self.queue.put, reuse_buffers,
+                decimator=decimator, latency=latency,
+                callback_seconds=callback_seconds,
+                buffer_seconds=buffer_seconds, trigger=trigger,
+                trigger_edge=trigger_edge)
+            self.pool = self.task.pool
+            self.clock = self.task.clock
+            self.queue.release = self.pool.release
             self.task.StartTask()
 
-            def gen(q):
-                while True:
-                    yield q.get()
-
-            return gen(self.queue)
-
-            # self.queue = asyncio.Queue()
-            # self.task.StartTask()
-            # while True:
-            #     yield (await self.queue.get())
+            return iter(self.queue)
+
+        # Reuse a committed task with the same settings if there is one
+        key = (seconds, rate, oversampling_ratio,
+               tuple(numpy.ravel(max_voltage).tolist()),
+               tuple(numpy.ravel(channels).tolist()),
+               numpy.ndim(channels) == 0, interleaved, chunk_seconds,
+               decimator, trigger, trigger_edge, pretrigger_seconds)
+        self.task = self._task_cache.pop(key, None)
+        self._unreserve_tasks(keep=self.task)
+        if self.task is None:
+            self.task = self.FOG_DAQ_Task(
+                self, seconds, rate, oversampling_ratio, max_voltage, False,
+                channels, interleaved, chunk_seconds=chunk_seconds,
+                decimator=decimator, trigger=trigger,
+                trigger_edge=trigger_edge,
+                pretrigger_seconds=pretrigger_seconds)
+        else:
+            self.task.reset()
+            if self.task is not self._reserved_task:
+                self.task.TaskControl(DAQmx_Val_Task_Commit)
+        self._reserved_task = None
+        self.pool = self.task.pool
+        self.clock = self.task.clock
+        self.trigger_index = self.task.trigger_index
 
         if not asynchronous:
-            self.task.StartTask()
-            self.task.run()
-            self.task.StopTask()
-            self.task.ClearTask()
+            try:
+                self.task.StartTask()
+                self.data = self.task.acquire()
+                # A stopped task returns to the committed state
+                self.task.StopTask()
+            except Exception:
+                # Release the device rather than leave it reserved
+                self.task.ClearTask()
+                self.task = None
+                raise
+            self._cache_task(key, self.task)
+            self._reserved_task = self.task
             self.task = None
             return self.data * u.volts
 
     class FOG_DAQ_Task(Task):
         def __init__(self, daq, seconds, rate, oversampling_ratio, max_voltage,
-                     asynchronous):
+                     asynchronous, channels=(0,), interleaved=False,
+                     sink=None, reuse_buffers=False, chunk_seconds=None,
+                     decimator='boxcar', latency=None, callback_seconds=None,
+                     buffer_seconds=None, trigger=None, trigger_edge='rising',
+                     pretrigger_seconds=0):
 
-            Task.__init__(self)
+            super().__init__()
 
             self.daq = daq
-            self.max_voltage = max_voltage
+            # In asynchronous mode, each chunk is passed to sink
+            self.sink = sink
             self.oversampling_ratio = oversampling_ratio
             self.asynchronous = asynchronous
-
-            sample_size = int(seconds * rate * oversampling_ratio)
-            self.raw_data = numpy.zeros((sample_size,), dtype=numpy.float64)
+            self.interleaved = interleaved
+
+            # A scalar channel, e.g. 2 or numpy.int64(2), is returned as a
+            # one-dimensional array
+            self.squeeze = numpy.ndim(channels) == 0
+            if self.squeeze:
+                channels = (channels,)
+            self.channels = channels
+
+            # One scale factor per channel, broadcast along the samples. The
+            # decimated readings are multiplied by this to give volts.
+            self.scale = numpy.broadcast_to(
+                numpy.asarray(max_voltage, dtype=numpy.float64),
+                (len(channels),)).reshape(-1, 1) / 10
+            self.decimator = make_decimator(decimator, oversampling_ratio)
+
+            # The total number of samples per channel, the number read at a
+            # time, the number of decimated samples in each block passed to
+            # sink, and the depth of the device buffer. Long synchronous
+            # reads are read in chunks. In asynchronous mode, each block is
+            # assembled from several callbacks.
+            # The samples before a reference trigger come first.
+            pretrigger_size = (int(pretrigger_seconds * rate)
+                               * oversampling_ratio)
+            self.trigger_index = pretrigger_size // oversampling_ratio
+            total_size = (int(seconds * rate) * oversampling_ratio
+                          + pretrigger_size)
+            if asynchronous:
+                sample_size, block_size, buffer_size = _stream_sizes(
+                    rate, oversampling_ratio, seconds, latency,
+                    callback_seconds, buffer_seconds)
+            else:
+                sample_size = total_size
+                if chunk_seconds:
+                    # At least one decimated sample per chunk, even for
+                    # rates below 1 / chunk_seconds
+                    sample_size = min(
+                        total_size,
+                        max(1, int(chunk_seconds * rate))
+                        * oversampling_ratio)
+                block_size = sample_size // oversampling_ratio
+                buffer_size = sample_size
+                if pretrigger_size:
+                    # A reference trigger needs a finite acquisition, which
+                    # can still be read in chunks
+                    buffer_size = total_size
+                elif sample_size < total_size:
+                    # Leave room for the next chunks while one is decimated
+                    buffer_size = 4 * sample_size
+            self.total_size = total_size
+            self.sample_size = sample_size
+            self.block_size = block_size
+            self.raw_data = numpy.zeros(
+                (len(channels), sample_size), dtype=numpy.float64)
+
+            # The decimated output of the callbacks is written into blocks
+            # from this pool
+            self.pool = BufferPool((len(channels), block_size), reuse_buffers)
+            self._block = None
+            self._filled = 0
+
+            # The number of raw samples per channel read so far, and the
+            # host time at which they had been acquired
+            self.position = 0
+            self.clock = SampleClock(
+                rate * oversampling_ratio, oversampling_ratio,
+                self.decimator.delay)
 
             ##############################
             # Setup for CfgSampClkTiming #
@@ -222,7 +1011,11 @@ class NI_9215:
             # Specifies whether the task acquires or generates samples
             # continuously or if it acquires or generates a finite number of
             # samples.
-            if asynchronous:
+            # A chunked synchronous read runs continuously, and is stopped
+            # once every sample has been read, unless it has a reference
+            # trigger.
+            if asynchronous or (sample_size < total_size and
+                                not pretrigger_size):
                 sample_mode = DAQmx_Val_ContSamps
             else:
                 sample_mode = DAQmx_Val_FiniteSamps
@@ -230,14 +1023,15 @@ class NI_9215:
             # The number of samples to acquire for each channel in the task.
             # If sample mode is finite, this is the total number of samples.
             # If sample is continuous, this is the buffer size.
-            samps_per_channel_to_acquire = sample_size
+            samps_per_channel_to_acquire = buffer_size
 
             #################################
             # Setup for CreateAIVoltageChan #
             #################################
 
             # You can specify a list or range of channels
-            physical_channel = "%s/ai0" % daq.device_name
+            physical_channel = ",".join(
+                "%s/ai%i" % (daq.device_name, channel) for channel in channels)
 
             # The name(s) to assign the created virtual channel(s).
             # If you do not specify a name NI-DAQmx uses the physical channel
@@ -273,15 +1067,108 @@ class NI_9215:
 
             self.CfgSampClkTiming(
                     source, sampling_rate, active_edge, sample_mode,
-                    sample_size)
+                    samps_per_channel_to_acquire)
+
+            if asynchronous:
+                # Use exactly this buffer size, rather than a larger default
+                # that need not be a whole number of callbacks
+                self.CfgInputBuffer(buffer_size)
+
+            if trigger:
+                # Start on an edge of the trigger terminal. A reference
+                # trigger keeps the samples acquired before the edge.
+                if trigger_edge == 'falling':
+                    trigger_edge = DAQmx_Val_Falling
+                else:
+                    trigger_edge = DAQmx_Val_Rising
+                if pretrigger_size:
+                    self.CfgDigEdgeRefTrig(
+                        trigger, trigger_edge, pretrigger_size)
+                else:
+                    self.CfgDigEdgeStartTrig(trigger, trigger_edge)
 
             if asynchronous:
                 # Map EveryNCallback and DoneCallback into C callback functions
                 self.AutoRegisterEveryNSamplesEvent(DAQmx_Val_Acquired_Into_Buffer,
                                                     sample_size, 0, name='run')
                 self.AutoRegisterDoneEvent(0, name='finish')
+            else:
+                # Verify the settings and reserve the device now, rather than
+                # on every start, so that the task can be reused cheaply
+                self.TaskControl(DAQmx_Val_Task_Commit)
+
+        def reset(self):
+            """
+            Prepares a stopped task for another acquisition with the same
+            settings.
+            """
+            self.decimator.reset()
+            self._block = None
+            self._filled = 0
+            self.position = 0
+            self.clock = SampleClock(
+                self.clock.nominal_rate, self.oversampling_ratio,
+                self.decimator.delay)
 
         def run(self):
+            """
+            Reads and decimates one chunk into the current block. In
+            asynchronous mode, this is the EveryNSamples callback, and each
+            full block is passed to ``sink``.
+            """
+            # The samples to be read had been acquired by now
+            timestamp = time.monotonic()
+            if self._block is None:
+                self._block = self.pool.acquire()
+                self._filled = 0
+            filled = self._filled + self.sample_size // self.oversampling_ratio
+            self._read(self.sample_size)
+            self.position += self.sample_size
+            self.clock.update(self.position, timestamp)
+            self._decimate(
+                self.sample_size, self._block[:, self._filled:filled])
+            self._filled = filled
+            if filled < self.block_size:
+                return 0
+            data, self._block = self._block, None
+
+            if self.squeeze:
+                data = data[0]
+            data = data.view(Chunk)
+            data.index = self.position // self.oversampling_ratio - filled
+            data.timestamp = timestamp
+            data.clock = self.clock
+
+            if self.asynchronous:
+                self.sink(data)
+                return 0
+            else:
+                self.daq.data = data
+
+        def acquire(self):
+            """
+            Reads every sample of a synchronous acquisition, one chunk at a
+            time, and returns the decimated data. Only the raw data of a
+            single chunk is held in memory.
+            """
+            ratio = self.oversampling_ratio
+            data = numpy.empty(
+                (len(self.channels), self.total_size // ratio))
+            for start in range(0, self.total_size, self.sample_size):
+                samples = min(self.sample_size, self.total_size - start)
+                self._read(samples)
+                # The read blocks until the samples have been acquired
+                timestamp = time.monotonic()
+                self.position += samples
+                self.clock.update(self.position, timestamp)
+                self._decimate(
+                    samples, data[:, start // ratio:(start + samples) // ratio])
+
+            if self.squeeze:
+                data = data[0]
+            return data
+
+        def _read(self, samples):
             ###########################
             # Setup for ReadAnalogF64 #
             ###########################
@@ -289,7 +1176,7 @@ class NI_9215:
             # The number of samples, per channel, to read. If read_array does
             # not contain enough space, ReadAnalogF64 returns as many samples
             # as fit in read_array
-            num_samps_per_channel = len(self.raw_data)
+            num_samps_per_channel = samples
 
             # The amount of time, in seconds, to wait for the function to read
             # the samples. An infinite wait is specified by -1. The
@@ -297,14 +1184,17 @@ class NI_9215:
             timeout = -1
 
             # Specifies whether or not the samples are interleaved
-            fill_mode = DAQmx_Val_GroupByChannel
+            if self.interleaved:
+                fill_mode = DAQmx_Val_GroupByScanNumber
+            else:
+                fill_mode = DAQmx_Val_GroupByChannel
 
             # The array to read samples into, organized according to the
             # filling mode
             read_array = self.raw_data
 
             # The size of the array, in samples, into which samples are read
-            array_size_in_samps = len(self.raw_data)
+            array_size_in_samps = self.raw_data.size
 
             # The actual number of samples read from each channel
             samples_per_channel_read = byref(int32())
@@ -316,23 +1206,29 @@ class NI_9215:
                     num_samps_per_channel, timeout, fill_mode, read_array,
                     array_size_in_samps, samples_per_channel_read, reserved)
 
-            # Scale
-            data = self.raw_data/10 * self.max_voltage
+        def _decimate(self, samples, out):
+            # The samples read are packed at the start of raw_data
+            raw = self.raw_data.ravel()[:samples * len(self.channels)]
 
-            # Downsample
-            data = numpy.mean(data.reshape(-1, self.oversampling_ratio), axis=1)
-
-            if self.asynchronous:
-                self.daq.queue.put(data)
-                return 0
+            # Downsample straight into the output, then scale in place
+            if self.interleaved:
+                # Samples arrive scan by scan, as (samples, channels). The
+                # transpose is a view with one row per channel.
+                raw = raw.reshape(-1, len(self.channels)).T
             else:
-                self.daq.data = data
+                raw = raw.reshape(len(self.channels), -1)
+            self.decimator(raw, out)
+            out *= self.scale
 
         def finish(self, status):
             return 0  # (The function should return an integer)
 
     def stop(self):
-        """ If running in asynchronous mode, this stops the task"""
+        """ If running in asynchronous mode, this stops the task, and ends the
+        stream of chunks."""
+        # End the stream first. StopTask waits for a running callback, which
+        # may be blocked handing a chunk to a full buffer.
+        self._close_stream()
         self.task.StopTask()
         self.task.ClearTask()
         self.task = None
@@ -354,8 +1250,33 @@ class NI_9215:
 
     def reset(self):
         """Resets the DAQ to factory settings"""
+        self.clear_tasks()
         DAQmxResetDevice(self.device_name)
 
+    def clear_tasks(self):
+        """Clears the cached tasks, releasing the device."""
+        while self._task_cache:
+            _, task = self._task_cache.popitem()
+            task.ClearTask()
+        self._reserved_task = None
+
+    def _cache_task(self, key, task):
+        # Keeps the most recently used tasks, and clears the oldest
+        self._task_cache[key] = task
+        while len(self._task_cache) > self.task_cache_size:
+            _, task = self._task_cache.popitem(last=False)
+            task.ClearTask()
+            if task is self._reserved_task:
+                self._reserved_task = None
+
+    def _unreserve_tasks(self, keep=None):
+        # Frees the device for another task. The cached task that reserved
+        # it keeps its configuration, but has to be committed again.
+        task = self._reserved_task
+        if task is not None and task is not keep:
+            task.TaskControl(DAQmx_Val_Task_Unreserve)
+            self._reserved_task = None
+
     def _get_rate(self, rate, oversampling_ratio):
         # gather the rate from the inputs
         if rate and oversampling_ratio and rate * oversampling_ratio < 2:
@@ -374,6 +1295,15 @@ class NI_9215:
             rate = (.1/lia.time_constant).to('Hz').magnitude
             return max(2, rate)
 
+    def _get_channels(self, channels):
+        # gather the channels from the inputs
+        if channels is not None:
+            return channels
+        elif self.channels is not None:
+            return self.channels
+        else:
+            return 0
+
     def _get_max_voltage(self, max_voltage):
         # gather the maximum voltage from the inputs
         if max_voltage:
@@ -386,3 +1316,360 @@ class NI_9215:
 
             # ... not ready to implement yet
             return lia.sensitivity.to('volt').magnitude  # * u.volt
+
+
+def _autoregress(initial, a, w):
+    """
+    Computes ``x[k] = a * x[k - 1] + w[k]`` along the last axis, in place in
+    ``w``, starting from ``x[-1] = initial``. The recursion is evaluated as a
+    scaled cumulative sum, in blocks short enough for ``a ** -k`` to stay
+    finite.
+    """
+    samples = w.shape[-1]
+    block = samples
+    if a < 1:
+        block = max(1, min(samples, int(50 / -numpy.log(a))))
+    powers = a ** numpy.arange(1, block + 1)
+    previous = initial
+    for start in range(0, samples, block):
+        x = w[..., start:start + block]
+        p = powers[:x.shape[-1]]
+        x /= p
+        numpy.cumsum(x, axis=-1, out=x)
+        x += previous[..., None]
+        x *= p
+        previous = x[..., -1]
+    return w
+
+
+class GyroModel:
+    """
+    Generates the output voltage of a simulated fiber optic gyro, sample by
+    sample, for :class:`MockDAQ`. The rotation rate seen by the gyro is the
+    sum of
+
+    - the rotation, and a constant bias,
+    - white rate noise, whose Allan deviation at one hour is ``arw``,
+    - a first-order Gauss-Markov bias with standard deviation
+      ``bias_instability`` and correlation time ``correlation_time``,
+    - a rate random walk, whose Allan deviation at three hours is
+      ``rate_random_walk``,
+
+    and it is divided by the scale factor to give volts. Each channel is an
+    independent gyro seeing the same rotation.
+
+    Parameters:
+        scale_factor (float): The scale factor in deg/h/V.
+        arw (float): The angle random walk in deg/√h.
+        bias (float): The constant bias in deg/h.
+        bias_instability (float): The standard deviation of the Gauss-Markov
+            bias in deg/h.
+        correlation_time (float): The correlation time of the Gauss-Markov
+            bias in seconds.
+        rate_random_walk (float): The rate random walk in deg/h/√h.
+        rotation (float, callable): The rotation rate in deg/h, or a function
+            returning it for an array of times in seconds.
+        seed (int, optional): The seed of the random number generator.
+
+    Attributes:
+        time (float): The simulated time in seconds, advanced by each call to
+            :meth:`generate`.
+    """
+    def __init__(self, scale_factor=1e4, arw=.01, bias=0,
+                 bias_instability=.1, correlation_time=100,
+                 rate_random_walk=.01, rotation=0, seed=None):
+        self.scale_factor = scale_factor
+        self.arw = arw
+        self.bias = bias
+        self.bias_instability = bias_instability
+        self.correlation_time = correlation_time
+        self.rate_random_walk = rate_random_walk
+        self.rotation = rotation
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        """Restarts the simulation with a new random number generator."""
+        self.rng = numpy.random.default_rng(seed)
+        self.time = 0
+        self._markov = None
+        self._walk = None
+
+    def generate(self, out, rate):
+        """
+        Writes the next samples of each channel into ``out``.
+
+        Args:
+            out (numpy.array): The array to fill with volts, with one row per
+                channel.
+            rate (float): The sample rate in samples per second.
+        """
+        channels, samples = out.shape
+        dt = 1 / rate
+        if self._markov is None or len(self._markov) != channels:
+            # Start from the stationary distribution of the bias
+            self._markov = (
+                self.rng.standard_normal(channels) * self.bias_instability)
+            self._walk = numpy.zeros(channels)
+
+        # White rate noise, averaged over one sample period
+        signal = self.rng.standard_normal((channels, samples))
+        signal *= self.arw * numpy.sqrt(3600 / dt)
+
+        if self.bias_instability:
+            a = numpy.exp(-dt / self.correlation_time)
+            w = self.rng.standard_normal((channels, samples))
+            w *= self.bias_instability * numpy.sqrt(1 - a * a)
+            signal += _autoregress(self._markov, a, w)
+            self._markov = w[:, -1].copy()
+
+        if self.rate_random_walk:
+            w = self.rng.standard_normal((channels, samples))
+            w *= self.rate_random_walk * numpy.sqrt(dt / 3600)
+            signal += _autoregress(self._walk, 1, w)
+            self._walk = w[:, -1].copy()
+
+        rotation = self.rotation
+        if callable(rotation):
+            rotation = rotation(self.time + numpy.arange(samples) * dt)
+        signal += rotation
+        signal += self.bias
+        numpy.divide(signal, self.scale_factor, out=out)
+        self.time += samples * dt
+
+
+class SimulatedTask(Task):
+    """
+    Stands in for a PyDAQmx ``Task``, reading samples from the
+    :class:`GyroModel` of the task's ``daq`` instead of from a device. Only
+    the parts of the DAQmx API used by :class:`NI_9215.FOG_DAQ_Task` are
+    simulated.
+
+    If the DAQ is ``realtime``, samples become available at the sample clock
+    rate, and a continuous task whose callback falls more than a buffer
+    behind raises a :class:`BufferOverrunError`, like the device. Otherwise,
+    samples are available as fast as they can be generated.
+    """
+    def __init__(self):
+        # No DAQmx task is created
+        self._thread = None
+        self._stopped = threading.Event()
+        self._every_n = None
+        self._done = None
+        self._trigger = None
+        self.error = None
+        self.committed = False
+
+    def CreateAIVoltageChan(self, physical_channel, name_to_assign_channel,
+                            terminal_config, min_val, max_val, units,
+                            custom_scale_name):
+        self._channels = len(physical_channel.split(','))
+        self._range = (min_val, max_val)
+
+    def CfgSampClkTiming(self, source, rate, active_edge, sample_mode,
+                         samps_per_chan):
+        self._rate = rate
+        # The rate of the simulated sample clock, against the host clock
+        self._clock_rate = rate * (1 + self.daq.clock_error)
+        self._finite = sample_mode == DAQmx_Val_FiniteSamps
+        self._buffer_size = samps_per_chan
+        if not self._finite:
+            # DAQmx uses the larger of the requested buffer size and a
+            # default that depends on the rate
+            for limit, default in ((100, 1000), (1e4, 10000), (1e6, 100000)):
+                if rate <= limit:
+                    break
+            else:
+                default = 1000000
+            self._buffer_size = max(samps_per_chan, default)
+
+    def CfgInputBuffer(self, num_samps_per_chan):
+        self._buffer_size = num_samps_per_chan
+
+    def AutoRegisterEveryNSamplesEvent(self, event_type, samples, options,
+                                       name='EveryNCallback'):
+        self._every_n = (samples, getattr(self, name))
+
+    def AutoRegisterDoneEvent(self, options, name='DoneCallback'):
+        self._done = getattr(self, name)
+
+    def CfgDigEdgeStartTrig(self, trigger_source, trigger_edge):
+        self._trigger = 0
+
+    def CfgDigEdgeRefTrig(self, trigger_source, trigger_edge,
+                          pretrigger_samples):
+        self._trigger = pretrigger_samples
+
+    def StartTask(self):
+        if (self._every_n is not None and not self._finite and
+                self._buffer_size % self._every_n[0]):
+            raise RuntimeError(
+                "The buffer size must be an even multiple of the Every N "
+                "Samples Event Interval. (-200877)")
+        self._reserve()
+        self._position = 0
+        self._start = time.monotonic()
+        if self._trigger is not None:
+            # The simulated edge arrives trigger_delay after the start, but a
+            # reference trigger is only armed once the pretrigger samples
+            # have been acquired. The data starts that many samples earlier.
+            pretrigger = self._trigger / self._clock_rate
+            self._start += max(self.daq.trigger_delay, pretrigger) - pretrigger
+        self._stopped.clear()
+        if self._every_n is not None:
+            self._thread = threading.Thread(target=self._callbacks)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def StopTask(self):
+        # Like DAQmx, wait for a callback that is already running to return,
+        # unless the task is stopped from within it
+        self._stopped.set()
+        thread, self._thread = self._thread, None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        # A task that was not committed releases the device when it stops
+        if not self.committed:
+            self._unreserve()
+
+    def ClearTask(self):
+        self.StopTask()
+        self._unreserve()
+
+    def TaskControl(self, action):
+        if action == DAQmx_Val_Task_Commit:
+            self._reserve()
+            self.committed = True
+        elif action == DAQmx_Val_Task_Unreserve:
+            self._unreserve()
+            self.committed = False
+
+    def _reserve(self):
+        # Only one task at a time can reserve the device, as in DAQmx
+        if self.daq._reservation not in (None, self):
+            raise RuntimeError(
+                "The specified resource is reserved. The operation could "
+                "not be completed as specified. (-50103)")
+        self.daq._reservation = self
+
+    def _unreserve(self):
+        if self.daq._reservation is self:
+            self.daq._reservation = None
+
+    def ReadAnalogF64(self, num_samps_per_channel, timeout, fill_mode,
+                      read_array, array_size_in_samps,
+                      samples_per_channel_read, reserved):
+        samples = num_samps_per_channel
+        if self._finite and self._position + samples > self._buffer_size:
+            raise ValueError(
+                "Attempted to read past the end of a finite acquisition.")
+        if self.daq.realtime:
+            self._wait_for(self._position + samples, timeout)
+
+        data = read_array.ravel()[:samples * self._channels]
+        if fill_mode == DAQmx_Val_GroupByScanNumber:
+            data = data.reshape(samples, self._channels).T
+        else:
+            data = data.reshape(self._channels, samples)
+        self.daq.model.generate(data, self._rate)
+        numpy.clip(data, *self._range, out=data)
+
+        self._position += samples
+        samples_per_channel_read._obj.value = samples
+        return 0
+
+    def _wait_for(self, position, timeout):
+        # Waits until the sample clock has reached position
+        elapsed = time.monotonic() - self._start
+        if (not self._finite and
+                elapsed * self._clock_rate - self._position >
+                self._buffer_size):
+            raise BufferOverrunError(
+                "Samples were overwritten in the DAQ buffer before they "
+                "were read.")
+        delay = position / self._clock_rate - elapsed
+        if delay > 0:
+            if 0 <= timeout < delay:
+                raise TimeoutError(
+                    "No data within %f seconds." % timeout)
+            time.sleep(delay)
+
+    def _callbacks(self):
+        # Calls the EveryNSamples callback each time enough samples are
+        # available, until the task is stopped
+        samples, callback = self._every_n
+        stopped = self._stopped
+        while not (self._finite and
+                   self._position + samples > self._buffer_size):
+            if self.daq.realtime:
+                delay = (self._start
+                         + (self._position + samples) / self._clock_rate
+                         - time.monotonic())
+                if stopped.wait(max(0, delay)):
+                    return
+            elif stopped.is_set():
+                return
+            try:
+                callback()
+            except Exception as error:
+                # The device stops acquiring after an error
+                self.error = error
+                return
+        if self._done is not None:
+            self._done(0)
+
+
+class MockDAQ(NI_9215):
+    """
+    A simulated NI 9215, for running the acquisition and analysis pipeline
+    without hardware, e.g. on Linux. It has the same :meth:`read`,
+    :meth:`astream` and :meth:`stop` API as :class:`NI_9215`, and uses the
+    same tasks, decimators and buffers, but the samples come from a
+    :class:`GyroModel`.
+
+    >>> daq = MockDAQ(seed=0, rotation=15)
+    >>> data = daq.read(1, rate=100)
+
+    Parameters:
+        device_name, max_voltage, rate, channels, task_cache_size: As for
+            :class:`NI_9215`.
+            The DAQ range is ±10 V, so with the default ``max_voltage`` of
+            10 the data is the simulated gyro output.
+        realtime (bool): If true, samples become available at the sample
+            clock rate, as from the device. If false, they are generated as
+            fast as they are read, for load testing.
+        clock_error (float): The fractional error of the simulated sample
+            clock rate, e.g. ``50e-6`` for a clock running 50 ppm fast.
+        trigger_delay (float): The time in seconds from the start of a
+            triggered task to the simulated trigger edge.
+        seed (int, optional): The seed of the simulation.
+        **model: Passed to :class:`GyroModel`, e.g. ``arw`` or ``rotation``.
+
+    Attributes:
+        model (GyroModel): The simulated gyro. Its attributes, e.g.
+            ``rotation``, can be changed during an acquisition.
+    """
+    def __init__(self, device_name='SimDev1', max_voltage=10, rate=None,
+                 channels=None, realtime=True, clock_error=0,
+                 trigger_delay=0, seed=None, task_cache_size=8, **model):
+        NI_9215.__init__(self, device_name, max_voltage, rate, channels,
+                         task_cache_size)
+        self.realtime = realtime
+        self.clock_error = clock_error
+        self.trigger_delay = trigger_delay
+        self.model = GyroModel(seed=seed, **model)
+        # The simulated task that has reserved the device
+        self._reservation = None
+
+    class FOG_DAQ_Task(NI_9215.FOG_DAQ_Task, SimulatedTask):
+        pass
+
+    def identify(self):
+        return "Simulated NI 9215"
+
+    @property
+    def tasks(self):
+        return ""
+
+    def reset(self):
+        """Restarts the simulation with a new seed."""
+        self.model.seed()
@@ -95,6 +95,18 @@ class Gyro:
         >>> test1 = gyro.tombstone(hours=4) #fill tombstone w data for 4 hrs?
 
     """
+    # The time in seconds allowed for the rotation stage to reach a constant
+    # velocity after a background rotation is requested, as in the original
+    # fixed one second wait. It can be given as "spin_up_time" in the json
+    # file once measured for a stage. The lock-in output is then given time
+    # to settle with ``lia.wait_settled()``.
+    spin_up_time = 1
+
+    # The DAQ terminal wired to the rotation stage's at-velocity output, e.g.
+    # '/cDAQ1/PFI0'. If set, calibration reads start on its edge instead of
+    # after ``spin_up_time``. It can be given as "trigger" in the json file.
+    trigger = None
+
     def __init__(self, filepath):
         with open(filepath) as gyro_file:
             string = ""
@@ -118,6 +130,10 @@ class Gyro:
             if 'radius' in self.data:
                 self.diameter = self.data['radius'] * 2
                 self.radius = self.data['radius']
+            if 'trigger' in self.data:
+                self.trigger = self.data['trigger']
+            if 'spin_up_time' in self.data:
+                self.spin_up_time = self.data['spin_up_time']
             self.logger = logging.getLogger(__name__)
             self.logger.info("Gyro '%s' loaded.")
 
@@ -155,7 +171,8 @@ class Gyro:
         lia.sensitivity = sensitivity
         start_angle = rot.angle
         rot.ccw(2, background=True)
-        time.sleep(1)
+        time.sleep(self.spin_up_time)
+        lia.wait_settled()
         lia.autophase()
 
         # return variables to initial condition
@@ -214,16 +231,15 @@ class Gyro:
             1/cal_integration_time.to('seconds').magnitude)
 
         # start acquisition and store the calibrated data
+        start = time.monotonic()
         rot.ccw(velocity * 4.5 * u.seconds, background=True)
-        time.sleep(1)
-        ccw_data = daq.read(seconds=3, rate=cal_acquisition_rate,
-                            verbose=False)
-        time.sleep(5)
+        ccw_data = self._read_rotating(3, cal_acquisition_rate)
+        self._wait_rotated(start)
 
+        start = time.monotonic()
         rot.cw(velocity * 4.5 * u.seconds, background=True)
-        time.sleep(1)
-        cw_data = daq.read(seconds=3, rate=cal_acquisition_rate, verbose=False)
-        time.sleep(5)
+        cw_data = self._read_rotating(3, cal_acquisition_rate)
+        self._wait_rotated(start)
 
         lia.time_constant = cal_integration_time
         lia.sensitivity = cal_sensitivity
@@ -246,6 +262,47 @@ class Gyro:
 
         return scale_factor
 
+    def _read_rotating(self, seconds, rate):
+        """
+        Reads the DAQ once a background rotation has reached a constant
+        velocity and the lock-in output has settled.
+
+        If :attr:`trigger` is set, the acquisition starts on the rotation
+        stage's edge, and the settling time is cut from the start of the
+        data, so no time is spent sleeping. Otherwise, this waits
+        :attr:`spin_up_time` and the settling time first.
+
+        Args:
+            seconds (float): The duration of the data in seconds.
+            rate (float): The sample rate.
+        """
+        if not self.trigger:
+            time.sleep(self.spin_up_time)
+            lia.wait_settled()
+            return daq.read(seconds=seconds, rate=rate, verbose=False)
+
+        settle = int(np.ceil(lia.settle_time().to('second').magnitude * rate))
+        data = daq.read(seconds=seconds + settle / rate, rate=rate,
+                        verbose=False, trigger=self.trigger)
+        return data[..., settle:]
+
+    def _wait_rotated(self, start):
+        """
+        Waits for a 4.5 s background rotation to finish after a read.
+
+        Without :attr:`trigger`, the time the read started after the rotation
+        is not known, so this waits a full 5 s. With it, the read started on
+        the stage's edge, and this waits until 5 s after ``start``.
+
+        Args:
+            start (float): The :func:`time.monotonic` time of the rotation
+                request.
+        """
+        if not self.trigger:
+            time.sleep(5)
+        else:
+            time.sleep(max(0, 5 - (time.monotonic() - start)))
+
     def tombstone(self, seconds=None, minutes=None, hours=None, rate=None,
                   autophase=False, autohome=True, scale_factor=0,
                   sensitivity=None, max_duration=None):
@@ -299,13 +356,13 @@ class Gyro:
 
         scale_factor = scale_factor.to('deg/hour/volt')
 
-        start = time.time()
-
         if duration:
             print('Running sync')
             data = daq.read(duration, rate)
             if not rate:
                 rate = len(data)/duration
+            # The time of the first sample, measured by the DAQ's clock model
+            start = daq.clock.wall_time(0)
             # TODO: Tombstone should take unit data... I think...
             return Tombstone(data.magnitude, rate, start=start,
                              scale_factor=scale_factor.magnitude)
@@ -370,7 +427,13 @@ class Gyro:
         data = daq.read(1, rate, asynchronous=True)
         i = 0
         while i < rate*max_duration:
-            data_to_add = next(data)
+            data_to_add = next(data, None)
+            if data_to_add is None:
+                # daq.stop() was called
+                return
+            # Place each chunk by the index of its first sample, so that
+            # any dropped chunks leave a gap rather than shifting the data
+            i = data_to_add.index
             next_i = i + len(data_to_add)
 
             if next_i > len(tmb):
@@ -22,6 +22,12 @@ import visa
 from hardware import u
 import random
 import logging
+import time
+import threading
+import bisect
+import math
+import numpy as np
+from collections import namedtuple
 
 class MockLockInAmplifier:
     """
@@ -105,49 +111,99 @@ class SRS_SR844:
         time_constant (float): The time constant for the lock-in amplifier
             filter.
     """
+    # see the SNAP? command in the SR844 manual
+    _snap_dict = {
+        'x': 1,
+        'y': 2,
+        'r': 3,
+        'r_dbm': 4,
+        'theta': 5,
+        'aux1': 6,
+        'aux2': 7,
+        'frequency': 8,
+        'ch1': 9,
+        'ch2': 10,
+    }
+
+    _sensitivity_dict = {
+        0: {"Vrms": 100e-9, "dBm": -127},
+        1: {"Vrms": 300e-9, "dBm": -117},
+        2: {"Vrms": 1e-6, "dBm": -107},
+        3: {"Vrms": 3e-6, "dBm": -97},
+        4: {"Vrms": 10e-6, "dBm": -87},
+        5: {"Vrms": 30e-6, "dBm": -77},
+        6: {"Vrms": 100e-6, "dBm": -67},
+        7: {"Vrms": 300e-6, "dBm": -57},
+        8: {"Vrms": 1e-3, "dBm": -47},
+        9: {"Vrms": 3e-3, "dBm": -37},
+        10: {"Vrms": 10e-3, "dBm": -27},
+        11: {"Vrms": 30e-3, "dBm": -17},
+        12: {"Vrms": 100e-3, "dBm": -7},
+        13: {"Vrms": 300e-3, "dBm": 3},
+        14: {"Vrms": 1, "dBm": 13},
+    }
+
+    # see page 115 of manual
+    _time_constant_list = [  # query by index
+        100e-6,
+        300e-6,
+        1e-3,
+        3e-3,
+        10e-3,
+        30e-3,
+        100e-3,
+        300e-3,
+        1,
+        3,
+        10,
+        30,
+        100,
+        300,
+        1e3,
+        3e3,
+        10e3,
+        30e3
+    ]
+
+    # see the SRAT command in the SR844 manual
+    _sample_rate_list = [  # query by index
+        62.5e-3, 125e-3, 250e-3, 500e-3, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512
+    ]
+
+    # The data buffer holds this many points per channel
+    _buffer_size = 16383
+
+    # see the OFSL command in the SR844 manual
+    _filter_slope_list = [0, 6, 12, 18, 24]  # query by index
+
+    # Units of each CH1 and CH2 display, see the DDEF command in the SR844
+    # manual. Displays in dBm have no unit.
+    _display_units = {
+        1: [u.volt, u.volt, None, u.volt, u.volt],  # X, R, R dBm, Xn, AUX1
+        2: [u.volt, u.degree, u.volt, None, u.volt],  # Y, θ, Yn, Yn dBm, AUX2
+    }
+
+    # Sorted lookup tables, indexed by the GPIB key, and their reverse maps
+    _sensitivity_list = [
+        d['Vrms'] for _, d in sorted(_sensitivity_dict.items())]
+    _sensitivity_index = {val: key for key, val in enumerate(_sensitivity_list)}
+    _time_constant_index = {
+        val: key for key, val in enumerate(_time_constant_list)}
+    _sample_rate_index = {
+        val: key for key, val in enumerate(_sample_rate_list)}
+
     def __init__(self, visa_search_term):
         rm = visa.ResourceManager()
         self.inst = rm.open_resource(visa_search_term)
 
-        self._sensitivity_dict = {
-            0: {"Vrms": 100e-9, "dBm": -127},
-            1: {"Vrms": 300e-9, "dBm": -117},
-            2: {"Vrms": 1e-6, "dBm": -107},
-            3: {"Vrms": 3e-6, "dBm": -97},
-            4: {"Vrms": 10e-6, "dBm": -87},
-            5: {"Vrms": 30e-6, "dBm": -77},
-            6: {"Vrms": 100e-6, "dBm": -67},
-            7: {"Vrms": 300e-6, "dBm": -57},
-            8: {"Vrms": 1e-3, "dBm": -47},
-            9: {"Vrms": 3e-3, "dBm": -37},
-            10: {"Vrms": 10e-3, "dBm": -27},
-            11: {"Vrms": 30e-3, "dBm": -17},
-            12: {"Vrms": 100e-3, "dBm": -7},
-            13: {"Vrms": 300e-3, "dBm": 3},
-            14: {"Vrms": 1, "dBm": 13},
-        }
+        # If true, the sensitivity, time constant and sample rate setters
+        # round to the nearest valid setting instead of raising a ValueError
+        self.snap_to_nearest = False
 
-        # see page 115 of manual
-        self._time_constant_list = [  # query by index
-            100e-6,
-            300e-6,
-            1e-3,
-            3e-3,
-            10e-3,
-            30e-3,
-            100e-3,
-            300e-3,
-            1,
-            3,
-            10,
-            30,
-            100,
-            300,
-            1e3,
-            3e3,
-            10e3,
-            30e3
-        ]
+        # The last time constant (s) and filter slope (dB/oct) read from or
+        # written to the lock-in. Used by settle_time() to avoid a query.
+        self._time_constant = None
+        self._filter_slope = None
 
         # see page 134 of SR844 manual
         self._status_dictionary = {
@@ -174,84 +230,298 @@ class SRS_SR844:
         }
         self.logger = logging.getLogger(__name__ + ".SRS SR844")
 
+        # Serializes all bus traffic, so that a background thread such as
+        # the StatusMonitor can share the bus with the caller
+        self._lock = threading.RLock()
+
+    def _query(self, command):
+        with self._lock:
+            return self.inst.query(command)
+
+    def _write(self, command):
+        with self._lock:
+            self.inst.write(command)
+
+    def _read_stb(self):
+        with self._lock:
+            return self.inst.read_stb()
+
     def identify(self):
         """
         Returns:
             str: The response from an ``*IDN?`` GPIB query.
         """
-        return self.inst.query('*IDN?')[:-1]
+        return self._query('*IDN?')[:-1]
 
     @property
     def phase(self):
-        return float(self.inst.query('PHAS?')[:-1]) * u.degree
+        return float(self._query('PHAS?')[:-1]) * u.degree
 
     @phase.setter
     @u.wraps(None, (None, u.degree))
     def phase(self, val):
         if(val > 180 or val < -180):
             raise ValueError("Phase must be between -180 and 180 degrees")
-        self.inst.write('PHAS %f' % val)
+        self._write('PHAS %f' % val)
         self.logger.info("Phase set to %f degrees." % val)
 
     @property
     def sensitivity(self):
-        key = int(self.inst.query('SENS?'))
+        key = int(self._query('SENS?'))
         return self._sensitivity_dict[key]['Vrms'] * u.volt
 
     @sensitivity.setter
     @u.wraps(None, (None, u.volt))
     def sensitivity(self, val):
-        key = [d['Vrms'] for d in self._sensitivity_dict.values()].index(val)
-        # create array of Vrms values from dictionary by iterating through values
-        # from the values we are only looking at those w [Vrms] key
-        # if find the Vrms key index, that index is the sensitivity
-        if key not in self._sensitivity_dict:
-            raise ValueError("Not a valid sensitivity")
-        self.inst.write('SENS %i' % key)
+        key = _lookup(self._sensitivity_list, self._sensitivity_index, val,
+                      self.snap_to_nearest, "Not a valid sensitivity")
+        val = self._sensitivity_list[key]
+        self._write('SENS %i' % key)
         self.logger.info("Sensitivity set to %f V." % val)
-        # raise Exception if value isn't in the array (Value Error)
 
     @property
     def time_constant(self):
-        key = int(self.inst.query('OFLT?'))
-        return self._time_constant_list[key] * u.second
+        key = int(self._query('OFLT?'))
+        self._time_constant = self._time_constant_list[key]
+        return self._time_constant * u.second
 
     @time_constant.setter
     @u.wraps(None, (None, u.second))
     def time_constant(self, val):
-        if val not in self._time_constant_list:
-            raise ValueError("Not a valid time constant")
-        key = self._time_constant_list.index(val)
-        self.inst.write('OFLT %i' % key)
+        key = _lookup(self._time_constant_list, self._time_constant_index, val,
+                      self.snap_to_nearest, "Not a valid time constant")
+        val = self._time_constant_list[key]
+        self._write('OFLT %i' % key)
+        self._time_constant = val
         self.logger.info("Time constant set to %f seconds." % val)
 
+    @property
+    def filter_slope(self):
+        """int: The slope of the time constant filter in dB/octave."""
+        key = int(self._query('OFSL?'))
+        self._filter_slope = self._filter_slope_list[key]
+        return self._filter_slope
+
+    @filter_slope.setter
+    def filter_slope(self, val):
+        if val not in self._filter_slope_list:
+            raise ValueError("Not a valid filter slope")
+        self._write('OFSL %i' % self._filter_slope_list.index(val))
+        self._filter_slope = val
+        self.logger.info("Filter slope set to %i dB/oct." % val)
+
+    def settle_time(self, fraction=1e-3):
+        """
+        Computes how long the output takes to settle after a step change of
+        the input.
+
+        The time constant filter is a cascade of identical single pole
+        filters, one for every 6 dB/oct of slope. The step response of
+        :math:`n` poles is within ``fraction`` of its final value once
+        :math:`e^{-t/\\tau} \\sum_{k<n} (t/\\tau)^k / k!` falls below
+        ``fraction``. The last time constant and filter slope seen by this
+        object are used, so no query is needed after they have been set or
+        read once.
+
+        Args:
+            fraction (float): The acceptable remaining fraction of the step.
+
+        Returns:
+            Quantity: The settling time in seconds.
+        """
+        if self._time_constant is None:
+            self.time_constant
+        if self._filter_slope is None:
+            self.filter_slope
+        # Without a filter, the output still follows a single time constant
+        poles = max(self._filter_slope // 6, 1)
+        return _settle_factor(poles, fraction) * self._time_constant * u.second
+
+    def wait_settled(self, fraction=1e-3):
+        """
+        Sleeps until the output has settled to within ``fraction`` of a step
+        change. See :meth:`settle_time`.
+
+        Args:
+            fraction (float): The acceptable remaining fraction of the step.
+        """
+        time.sleep(self.settle_time(fraction).to('second').magnitude)
+
     @property
     def x(self):
-        return float(self.inst.query('OUTP? 1'))
+        return float(self._query('OUTP? 1'))
 
     @property
     def y(self):
-        return float(self.inst.query('OUTP? 2'))
+        return float(self._query('OUTP? 2'))
+
+    def snap(self, *params):
+        """
+        Reads between two and six parameters at the same instant with a single
+        ``SNAP?`` query. Unlike reading :attr:`x` and :attr:`y` separately, the
+        values come from the same moment, and only one round trip is needed.
+
+        Args:
+            *params (str): The parameters to read. Any of ``'x'``, ``'y'``,
+                ``'r'``, ``'r_dbm'``, ``'theta'``, ``'aux1'``, ``'aux2'``,
+                ``'frequency'``, ``'ch1'`` and ``'ch2'``. Defaults to ``'x'``
+                and ``'y'``.
+
+        Returns:
+            namedtuple: The values, as floats, with fields named by
+            ``params``.
+
+        Examples:
+            >>> x, y = lia.snap('x', 'y')
+            >>> lia.snap('r', 'theta').theta
+        """
+        if not params:
+            params = ('x', 'y')
+        if not 2 <= len(params) <= 6:
+            raise ValueError("SNAP? reads between two and six parameters")
+        for param in params:
+            if param not in self._snap_dict:
+                raise ValueError("Not a valid SNAP? parameter: %s" % param)
+
+        response = self._query(
+            'SNAP? ' + ','.join(str(self._snap_dict[p]) for p in params))
+        return _snap_tuple(params)(*map(float, response.split(',')))
 
     @property
     def x_offset(self):
-        return float(self.inst.query('DOFF? 1,0'))
+        return float(self._query('DOFF? 1,0'))
 
     @x_offset.setter
     def x_offset(self, val):
         if val > 110 or val < -110:
             raise ValueError('Offset must be between -110% and 110%')
-        self.inst.write('DOFF 1,0,%.2f' % val)
+        self._write('DOFF 1,0,%.2f' % val)
 
     @property
     def y_offset(self):
-        return float(self.inst.query('DOFF? 2,0'))
+        return float(self._query('DOFF? 2,0'))
 
     @y_offset.setter
     def y_offset(self, val):
         if val > 100 or val < -110:
             raise ValueError('Offset must be between -110% and 110%')
-        self.inst.write('DOFF 2,0,%2.f' % val)
+        self._write('DOFF 2,0,%2.f' % val)
+
+    @property
+    def sample_rate(self):
+        """The rate at which points are stored in the data buffer."""
+        key = int(self._query('SRAT?'))
+        return self._sample_rate_list[key] * u.hertz
+
+    @sample_rate.setter
+    @u.wraps(None, (None, u.hertz))
+    def sample_rate(self, val):
+        key = _lookup(self._sample_rate_list, self._sample_rate_index, val,
+                      self.snap_to_nearest, "Not a valid sample rate")
+        val = self._sample_rate_list[key]
+        self._write('SRAT %i' % key)
+        self.logger.info("Sample rate set to %f Hz." % val)
+
+    @property
+    def buffer_points(self):
+        """int: The number of points stored in the data buffer."""
+        return int(self._query('SPTS?'))
+
+    def start_buffer(self, loop=False):
+        """
+        Clears the data buffer and starts storing points in it at
+        :attr:`sample_rate`.
+
+        Args:
+            loop (bool): If true, the oldest points are overwritten once the
+                buffer is full. Otherwise storage stops when it is full.
+        """
+        self._write('REST;SEND %i;STRT' % int(loop))
+
+    def stop_buffer(self):
+        """Pauses storing points in the data buffer."""
+        self._write('PAUS')
+
+    def read_buffer(self, channel=1, start=0, count=None, chunk_size=4096):
+        """
+        Transfers points from the data buffer with binary ``TRCB?`` queries.
+
+        Args:
+            channel (int): The buffer to read. Buffer 1 stores the channel 1
+                display, and buffer 2 stores the channel 2 display.
+            start (int): The index of the first point to read.
+            count (int, optional): The number of points to read. Defaults to
+                every stored point after ``start``.
+            chunk_size (int): The largest number of points in one transfer.
+
+        Returns:
+            numpy.array: The points, as 32-bit floats.
+        """
+        if count is None:
+            count = self.buffer_points - start
+
+        data = np.empty(count, dtype=np.float32)
+        for i in range(0, count, chunk_size):
+            n = min(chunk_size, count - i)
+            # TRCB? replies with 4 bytes per point and no header or terminator
+            with self._lock:
+                self.inst.write('TRCB? %i,%i,%i' % (channel, start + i, n))
+                raw = self.inst.read_bytes(4 * n)
+            data[i:i + n] = np.frombuffer(raw, dtype='<f4')
+        return data
+
+    @u.wraps(None, (None, u.second, u.hertz, None, None))
+    def buffered_read(self, seconds, rate, channels=(1, 2),
+                      chunk_size=4096):
+        """
+        Acquires hardware-timed data with the lock-in amplifier's internal data
+        buffer. Points are transferred in chunks while the acquisition runs.
+
+        Args:
+            seconds (float): The duration of the acquisition.
+            rate (float): The sample rate. Must be one of the rates in
+                :attr:`sample_rate`, up to 512 Hz, unless
+                :attr:`snap_to_nearest` is set, in which case the nearest
+                rate is used.
+            channels (tuple of int): The buffers to read.
+            chunk_size (int): The largest number of points in one transfer.
+
+        Returns:
+            tuple: One array per channel. Each buffer stores what its display
+            shows, so the array is in volts or degrees, or a plain array in
+            dBm for the dBm displays.
+        """
+        key = _lookup(self._sample_rate_list, self._sample_rate_index, rate,
+                      self.snap_to_nearest, "Not a valid sample rate")
+        rate = self._sample_rate_list[key]
+        count = int(seconds * rate)
+        if count > self._buffer_size:
+            raise ValueError(
+                "The buffer only holds %i points" % self._buffer_size)
+
+        units = [
+            self._display_units[channel][
+                int(self._query('DDEF? %i' % channel).split(',')[0])]
+            for channel in channels]
+        self.sample_rate = rate * u.hertz
+        data = np.empty((len(channels), count), dtype=np.float32)
+        self.start_buffer()
+
+        try:
+            read = 0
+            while read < count:
+                # Wait for a full chunk, or for the rest of the acquisition
+                time.sleep(min(chunk_size, count - read) / rate)
+                n = min(self.buffer_points, count) - read
+                for row, channel in enumerate(channels):
+                    data[row, read:read + n] = self.read_buffer(
+                        channel, read, n, chunk_size)
+                read += n
+        finally:
+            self.stop_buffer()
+
+        return tuple(row if unit is None else row * unit
+                     for row, unit in zip(data, units))
 
     def autophase(self):
         """
@@ -261,20 +531,46 @@ class SRS_SR844:
         the reference phase so that the current measurement has a Y value of
         zero and an X value equal to the signal magnitude, R.
         """
-        self.inst.write('APHS')
+        self._write('APHS')
 
-    def autogain(self):
+    def autogain(self, timeout=15):
         """
         Performs the built-in ``AGAN`` function in order to auto-gain the
-        lock-in amplifier.
+        lock-in amplifier, and waits for it to finish.
+
+        Args:
+            timeout (float): The maximum time to wait in seconds.
         """
-        self.inst.write('AGAN')
-        _old_timeout = self.inst.timeout
-        self.inst.timeout = 15e3
-        while int(self.inst.query('*STB?1')[:-1]):
-            # Do nothing until the status bit is clear
-            pass
-        self.inst.timeout = _old_timeout
+        self._write('AGAN')
+        self.wait_until_idle(timeout)
+
+    def wait_until_idle(self, timeout=15, interval=0.01, max_interval=0.5):
+        """
+        Blocks until the lock-in amplifier has finished executing commands.
+
+        The status is read with a serial poll rather than a ``*STB?`` query,
+        so it does not go through the command parser, and the poll interval
+        grows exponentially so that the bus stays free for other instruments.
+
+        Args:
+            timeout (float): The maximum time to wait in seconds.
+            interval (float): The initial polling interval in seconds.
+            max_interval (float): The longest polling interval in seconds.
+
+        Raises:
+            TimeoutError: If commands are still executing after ``timeout``
+                seconds.
+        """
+        deadline = time.monotonic() + timeout
+        # Bit 1 (IFC) of the serial poll status byte is set when no command
+        # execution is in progress.
+        while not self._read_stb() & 0b10:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(
+                    "Lock-in still busy after %f seconds." % timeout)
+            time.sleep(min(interval, remaining))
+            interval = min(2 * interval, max_interval)
 
     def get_status(self, status=None, verbose=False):
         """
@@ -290,7 +586,7 @@ class SRS_SR844:
             str: Status bits in binary form.
         """
         if status is None:
-            status = int(self.inst.query('LIAS?')[:-1])
+            status = int(self._query('LIAS?')[:-1])
         else:
             verbose = True
         status_bits = format(status, '016b')
@@ -304,3 +600,301 @@ class SRS_SR844:
             print("{name}:\t{set_when}".format(**self._status_dictionary[idx]))
 
         return status_bits
+
+    def monitor(self, period=1):
+        """
+        Starts recording changes of the status bits in the background. See
+        :class:`StatusMonitor`.
+
+        Args:
+            period (float): The time between ``LIAS?`` queries in seconds.
+
+        Returns:
+            StatusMonitor: The running monitor. Call its ``stop()`` method when
+            the measurement is done.
+        """
+        status_monitor = StatusMonitor(self, period)
+        status_monitor.start()
+        return status_monitor
+
+
+class StatusMonitor:
+    """
+    Polls the status bits of a lock-in amplifier with ``LIAS?`` in a
+    background thread, and records the host time of every change in a compact
+    array-backed log.
+
+    The times come from ``time.monotonic()``, so the log can be joined with
+    data acquisition samples timestamped on the same clock, e.g. to mask
+    samples taken while the input or filters were overloaded.
+
+    A poll that fails with a VISA error is logged and skipped, and polling
+    continues. The last such error is kept in ``error``.
+
+    Parameters:
+        lia (SRS_SR844): The lock-in amplifier to monitor.
+        period (float): The time between ``LIAS?`` queries in seconds.
+        capacity (int): The initial number of events the log can hold. The
+            log doubles in size whenever it fills up.
+
+    Attributes:
+        times (numpy.array): The time of each change.
+        status (numpy.array): The status bits after each change.
+        error (Exception): The last error raised by a poll, or ``None``.
+    """
+    def __init__(self, lia, period=1, capacity=1024):
+        self.lia = lia
+        self.period = period
+        self._times = np.empty(capacity)
+        self._status = np.empty(capacity, dtype=np.uint16)
+        self._count = 0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.error = None
+
+    def start(self):
+        """Starts polling in a background thread."""
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops polling, and waits for the background thread to finish."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        last = None
+        while not self._stop_event.is_set():
+            try:
+                status = int(self.lia._query('LIAS?'))
+            except (visa.VisaIOError, ValueError) as error:
+                self.error = error
+                self.lia.logger.error("Status poll failed: %s" % error)
+                self._stop_event.wait(self.period)
+                continue
+            if status != last:
+                self._record(time.monotonic(), status)
+                self.lia.logger.info(
+                    "Status changed to %s." % format(status, '016b'))
+                last = status
+            self._stop_event.wait(self.period)
+
+    def _record(self, t, status):
+        with self._lock:
+            if self._count == len(self._times):
+                self._times = np.resize(self._times, 2 * self._count)
+                self._status = np.resize(self._status, 2 * self._count)
+            self._times[self._count] = t
+            self._status[self._count] = status
+            self._count += 1
+
+    @property
+    def times(self):
+        with self._lock:
+            return self._times[:self._count].copy()
+
+    @property
+    def status(self):
+        with self._lock:
+            return self._status[:self._count].copy()
+
+    def status_at(self, times):
+        """
+        Returns the status bits that were in effect at each of ``times``.
+        Times before the first poll have no status bits set.
+        """
+        with self._lock:
+            event_times = self._times[:self._count]
+            event_status = self._status[:self._count]
+            idx = np.searchsorted(event_times, times, side='right') - 1
+            return np.where(
+                idx >= 0, event_status[np.maximum(idx, 0)], 0)
+
+    def mask(self, times, names=('INP', 'FLT', 'ULK')):
+        """
+        Flags the samples taken while any of the named conditions was
+        reported.
+
+        The status bits latch until they are read, so a condition reported by
+        a poll may have started up to one period earlier. A sample is flagged
+        if the condition was reported by the poll before or after it.
+
+        Args:
+            times (numpy.array): The ``time.monotonic()`` time of each sample.
+            names (tuple of str): Names of status bits from
+                :meth:`SRS_SR844.get_status`, e.g. ``'INP'``, ``'FLT'`` or
+                ``'ULK'``.
+
+        Returns:
+            numpy.array: ``True`` for each sample that should be discarded.
+        """
+        bits = 0
+        for idx, bit in self.lia._status_dictionary.items():
+            if bit['name'] in names:
+                bits |= 1 << idx
+
+        times = np.asarray(times)
+        status = self.status_at(times) | self.status_at(times + self.period)
+        return (status & bits) != 0
+
+
+class Autoranger:
+    """
+    Keeps a streamed lock-in amplifier signal within range by stepping the
+    sensitivity up or down while the acquisition keeps running.
+
+    Each chunk of X/Y data passed to :meth:`update` is compared with the
+    full scale of the current sensitivity. If the peak exceeds ``upper`` of
+    full scale, the next less sensitive range is selected. If it stays below
+    ``lower`` of the full scale of the next more sensitive range, that range
+    is selected. The gap between the two thresholds keeps the range from
+    toggling. Samples that clipped, and samples taken while the output
+    settles after a change, are tagged so that they can be discarded.
+
+    The data acquisition unit scales its readings with a fixed sensitivity,
+    ``scale``, so :meth:`update` rescales each chunk to the sensitivity that
+    was in effect when it was taken.
+
+    Parameters:
+        lia (SRS_SR844): The lock-in amplifier to control.
+        rate (float): The sample rate of the data in Hz.
+        upper (float): The fraction of full scale above which the range is
+            increased.
+        lower (float): The fraction of the next lower full scale below which
+            the range is decreased.
+        fraction (float): Passed to :meth:`SRS_SR844.settle_time` to decide
+            how many samples to tag after a change.
+        scale (float, optional): The sensitivity in volts that the data was
+            scaled with. Defaults to the current sensitivity.
+
+    Attributes:
+        changes (list of tuple): The sample index, and old and new
+            sensitivities in volts, of every change.
+    """
+    def __init__(self, lia, rate, upper=0.9, lower=0.5, fraction=1e-3,
+                 scale=None):
+        self.lia = lia
+        self.rate = rate
+        self.upper = upper
+        self.lower = lower
+        self.fraction = fraction
+
+        full_scale = lia.sensitivity.to('volt').magnitude
+        self._key = _lookup(lia._sensitivity_list, lia._sensitivity_index,
+                            full_scale, True, "Not a valid sensitivity")
+        self.scale = scale if scale is not None else full_scale
+
+        self.changes = []
+        self._count = 0
+        self._holdoff = 0
+
+    @property
+    def full_scale(self):
+        """float: The current sensitivity in volts."""
+        return self.lia._sensitivity_list[self._key]
+
+    def update(self, data):
+        """
+        Checks a chunk of data, and changes the sensitivity if needed.
+
+        Args:
+            data (numpy.array): The data in volts, as scaled with ``scale``.
+                Either one-dimensional, or two-dimensional with one row per
+                channel, e.g. X and Y.
+
+        Returns:
+            tuple: The data rescaled to the sensitivity in effect, and a
+            boolean array with ``True`` for each sample that clipped or was
+            taken while the output was settling.
+        """
+        data = np.asarray(data) * (self.full_scale / self.scale)
+        samples = data.shape[-1]
+
+        magnitude = np.abs(data)
+        if magnitude.ndim > 1:
+            magnitude = magnitude.max(axis=0)
+
+        tags = magnitude >= self.full_scale
+        tags[:self._holdoff] = True
+        self._holdoff = max(self._holdoff - samples, 0)
+        self._count += samples
+
+        peak = magnitude.max() if samples else 0
+        key = self._key
+        if peak > self.upper * self.full_scale:
+            key = min(key + 1, len(self.lia._sensitivity_list) - 1)
+        elif key > 0 and (
+                peak < self.lower * self.lia._sensitivity_list[key - 1]):
+            key = key - 1
+
+        if key != self._key:
+            old = self.full_scale
+            self._key = key
+            self.lia.sensitivity = self.full_scale * u.volt
+            self.changes.append((self._count, old, self.full_scale))
+            self._holdoff = int(math.ceil(
+                self.lia.settle_time(self.fraction).to('second').magnitude
+                * self.rate))
+
+        return data, tags
+
+
+_snap_tuples = dict()
+
+
+def _snap_tuple(params):
+    # Reuse one namedtuple class for each combination of SNAP? parameters
+    if params not in _snap_tuples:
+        _snap_tuples[params] = namedtuple('Snap', params)
+    return _snap_tuples[params]
+
+
+def _lookup(values, index, val, snap, message):
+    """
+    Returns the key of ``val`` in the sorted list ``values``. Exact matches
+    are found in the reverse map ``index``. Otherwise the nearest value is
+    found by bisection, comparing ratios since the settings are spaced
+    logarithmically. Unless ``snap`` is true, the nearest value must agree
+    with ``val`` to within floating point error, or a ValueError is raised.
+    """
+    if val in index:
+        return index[val]
+
+    i = bisect.bisect_left(values, val)
+    if i == 0:
+        key = 0
+    elif i == len(values):
+        key = len(values) - 1
+    elif val <= 0 or values[i] / val < val / values[i - 1]:
+        key = i
+    else:
+        key = i - 1
+
+    if not snap and not math.isclose(values[key], val, rel_tol=1e-9):
+        raise ValueError(message)
+    return key
+
+
+def _settle_factor(poles, fraction):
+    """
+    Returns the settling time, in time constants, of ``poles`` cascaded single
+    pole filters, found by bisection.
+    """
+    def residual(x):
+        return math.exp(-x) * sum(x**k / math.factorial(k)
+                                  for k in range(poles))
+
+    lo, hi = 0, 1
+    while residual(hi) > fraction:
+        hi *= 2
+    for _ in range(50):
+        mid = (lo + hi) / 2
+        if residual(mid) > fraction:
+            lo = mid
+        else:
+            hi = mid
+    return hi
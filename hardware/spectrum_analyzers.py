@@ -22,9 +22,87 @@ import visa
 import numpy as np
 from hardware import u
 import logging
+import time
+import threading
+import math
+from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from hardware import u
 
 
+MeasurementPlan = namedtuple(
+    'MeasurementPlan', ['span', 'rbw', 'vbw', 'time', 'averages',
+                        'predicted_time'])
+MeasurementPlan.__doc__ = """
+Settings chosen by :meth:`Rohde_Schwarz_FSEA_20.plan`. The span, bandwidths
+and sweep time are in Hz and seconds, and ``predicted_time`` is the total time
+in seconds for all ``averages`` sweeps.
+"""
+
+Segment = namedtuple('Segment', ['start', 'stop', 'lo', 'hi'])
+Segment.__doc__ = """
+One segment of a stitched sweep from :func:`plan_segments`. The segment is
+swept from ``start`` to ``stop`` in Hz, and points ``lo`` to ``hi`` of its
+trace are kept in the stitched spectrum.
+"""
+
+
+def plan_segments(start, stop, rbw, points, overlap=0.1, points_per_rbw=2):
+    """
+    Splits a wide span into segments that can each be swept at the required
+    resolution bandwidth.
+
+    Each segment is narrow enough that its ``points`` trace points are spaced
+    by no more than ``rbw / points_per_rbw``. All segments start on a common
+    grid of that spacing, which divides the span evenly, so the points of
+    neighbouring segments coincide where they overlap. Neighbouring segments
+    overlap by at least ``overlap`` of a segment, and each keeps the points
+    on its side of the middle of the overlap, so the stitched spectrum is
+    evenly spaced, with no gaps or duplicated points.
+
+    Args:
+        start (float): The start frequency in Hz.
+        stop (float): The stop frequency in Hz.
+        rbw (float): The resolution bandwidth in Hz.
+        points (int): The number of points in each trace.
+        overlap (float): The minimum fractional overlap between segments.
+        points_per_rbw (float): The number of trace points per RBW.
+
+    Returns:
+        list of Segment: The segments, in order of increasing frequency.
+    """
+    span = stop - start
+    if span <= (points - 1) * rbw / points_per_rbw:
+        return [Segment(start, stop, 0, points)]
+
+    # Work in whole grid steps, with the span an exact number of steps
+    steps = math.ceil(span * points_per_rbw / rbw)
+    df = span / steps
+    width = points - 1
+    max_step = max(1, math.floor(width * (1 - overlap)))
+    n = math.ceil((steps - width) / max_step) + 1
+    # Offsets of the segment starts, no more than max_step apart
+    offsets = [i * (steps - width) // (n - 1) for i in range(n)]
+
+    def frequency(k):
+        return stop if k == steps else start + k * df
+
+    segments = []
+    for i, k in enumerate(offsets):
+        if i == 0:
+            lo = 0
+        else:
+            # The middle of the overlap with the previous segment
+            lo = (offsets[i - 1] + width + k) // 2 + 1 - k
+        if i == n - 1:
+            hi = points
+        else:
+            hi = (k + width + offsets[i + 1]) // 2 + 1 - k
+        segments.append(Segment(frequency(k), frequency(k + width), lo, hi))
+    return segments
+
+
 class MockSpectrumAnalyzer:
     def __init__(self, instr_name = None):
         if not instr_name:
@@ -156,13 +234,8 @@ class ANDO_AQ6317B:
                 The first array contains the wavelengths in nanometers.
                 The second array contains the optical power in dBm.
         """
-        power_string = self.inst.query('LDAT%s' % channel)
-        power = np.array(power_string[:-2].split(','))
-        power = power.astype(np.float)[2:]
-
-        wavelength_string = self.inst.query('WDAT%s' % channel)
-        wavelength = np.array(wavelength_string[:-2].split(','))
-        wavelength = wavelength.astype(np.float)[2:]
+        power = self._parse_trace(self.inst.query('LDAT%s' % channel))
+        wavelength = self._parse_trace(self.inst.query('WDAT%s' % channel))
 
         return wavelength, power
         # pint doesn't have units for dBm
@@ -170,6 +243,130 @@ class ANDO_AQ6317B:
     # Alias
     acquire = get_spectrum
 
+    def get_spectra(self, channels='ABC'):
+        """
+        Returns the measured spectra of several traces in a single call.
+
+        The wavelength axis is shared by all of the traces, so it is only
+        transferred once. The level data for each trace is then requested back
+        to back, and each response is parsed on a worker thread while the next
+        one is still being transferred.
+
+        Args:
+            channels (str): The traces to read, e.g. ``'ABC'``.
+
+        Returns:
+            numpy.ndarray:
+                A two-dimensional array. The first row contains the wavelengths
+                in nanometers, and each following row contains the optical
+                power in dBm of one trace, in the order given by ``channels``.
+        """
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            wavelength = executor.submit(
+                self._parse_trace, self.inst.query('WDAT%s' % channels[0]))
+            powers = [
+                executor.submit(
+                    self._parse_trace, self.inst.query('LDAT%s' % channel))
+                for channel in channels]
+
+            return np.vstack(
+                [wavelength.result()] + [power.result() for power in powers])
+
+    @staticmethod
+    def _parse_trace(string):
+        # Strip the terminating CRLF and the two leading header values
+        return np.array(string[:-2].split(','), dtype=float)[2:]
+
+    def single_sweep(self):
+        """
+        Starts a single sweep. This command is the same as pressing the
+        `Single` button on the front panel.
+        """
+        self.inst.write('SGL')
+        self.logger.info("Single sweep started.")
+
+    def repeat_sweep(self):
+        """
+        Starts sweeping repeatedly. This command is the same as pressing the
+        `Repeat` button on the front panel.
+        """
+        self.inst.write('RPT')
+        self.logger.info("Repeat sweep started.")
+
+    def stop_sweep(self):
+        """
+        Stops the current sweep. This command is the same as pressing the
+        `Stop` button on the front panel.
+        """
+        self.inst.write('STP')
+        self.logger.info("Sweep stopped.")
+
+    @property
+    def sweep_status(self):
+        """
+        int: The response from a ``SWEEP?`` GPIB query.
+
+        - 0 - stopped
+        - 1 - single sweep in progress
+        - 2 - repeat sweep in progress
+        - 3 - auto sweep in progress
+        """
+        return int(self.inst.query('SWEEP?'))
+
+    def wait_for_sweep(self, timeout=60, interval=0.01, max_interval=0.5):
+        """
+        Blocks until the instrument reports that it is no longer sweeping.
+
+        The sweep status is polled with an exponentially increasing interval,
+        so short sweeps return quickly without flooding the bus during long
+        ones. A repeat sweep never finishes on its own, so call
+        :meth:`stop_sweep` first if one is running.
+
+        Args:
+            timeout (float): The maximum time to wait in seconds.
+            interval (float): The initial polling interval in seconds.
+            max_interval (float): The longest polling interval in seconds.
+
+        Raises:
+            TimeoutError: If the sweep has not finished after ``timeout``
+                seconds.
+        """
+        deadline = time.monotonic() + timeout
+        while self.sweep_status:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(
+                    "Sweep did not finish within %f seconds." % timeout)
+            time.sleep(min(interval, remaining))
+            interval = min(2 * interval, max_interval)
+
+    def spectra(self, channel='B', count=None, timeout=60):
+        """
+        Sweeps the instrument repeatedly, yielding each spectrum as soon as
+        its sweep is complete.
+
+        Each iteration starts a single sweep and waits for it with
+        :meth:`wait_for_sweep`, so every spectrum is fresh and no time is
+        spent in fixed delays.
+
+        Args:
+            channel (str): The trace to read.
+            count (int, optional): The number of spectra to yield. If not
+                specified, the generator runs until it is closed.
+            timeout (float): The maximum time to wait for each sweep in
+                seconds.
+
+        Yields:
+            tuple of arrays: The wavelengths and powers, as returned by
+            :meth:`get_spectrum`.
+        """
+        n = 0
+        while count is None or n < count:
+            self.single_sweep()
+            self.wait_for_sweep(timeout)
+            yield self.get_spectrum(channel)
+            n += 1
+
 
 class Rohde_Schwarz_FSEA_20:
     """
@@ -184,14 +381,22 @@ class Rohde_Schwarz_FSEA_20:
         self.inst = rm.open_resource(visa_search_term)
         self.logger = logging.getLogger(__name__ + ".Rhode Schwarz FSEA20")
 
+        # Transfer traces as little-endian 32-bit floats rather than ASCII
+        self.inst.write('FORM REAL,32')
+
+        # The frequency axis of the last trace. Cleared whenever the start or
+        # stop frequencies are changed through this object.
+        self._freqs = None
+
     @property
     def center(self):
-        float(self.inst.query('FREQ:CENT?')) * u.hertz
+        return float(self.inst.query('FREQ:CENT?')) * u.hertz
 
     @center.setter
     @u.wraps(None, (None, u.hertz))
     def center(self, Hz):
         self.inst.write('FREQ:CENT %s' % str(Hz))
+        self._freqs = None
         self.logger.info("Center set to %s Hz." % str(Hz))
 
     @property
@@ -202,6 +407,7 @@ class Rohde_Schwarz_FSEA_20:
     @u.wraps(None, (None, u.hertz))
     def span(self, Hz):
         self.inst.write('FREQ:SPAN %s' % str(Hz))
+        self._freqs = None
         self.logger.info("Span set to %s Hz." % str(Hz))
 
     @property
@@ -222,6 +428,7 @@ class Rohde_Schwarz_FSEA_20:
     @u.wraps(None, (None, u.hertz))
     def start(self, Hz):
         self.inst.write('FREQ:STAR %s' % str(Hz))
+        self._freqs = None
         self.logger.info("Start set to %s Hz." % str(Hz))
 
     @property
@@ -232,6 +439,7 @@ class Rohde_Schwarz_FSEA_20:
     @u.wraps(None, (None, u.hertz))
     def stop(self, Hz):
         self.inst.write('FREQ:STOP %s' % str(Hz))
+        self._freqs = None
         self.logger.info("Stop set to %s Hz." % str(Hz))
 
     @property
@@ -273,12 +481,543 @@ class Rohde_Schwarz_FSEA_20:
         self.inst.write('AVER:COUNT %i' % count)
         self.logger.info("Average set to %i." % count)
 
+    # Resolution and video bandwidths available on the FSEA 20, in Hz
+    _bandwidth_list = [
+        m * 10**e for e in range(0, 7) for m in (1, 2, 3, 5)] + [10e6]
+
+    # Standard deviation of log-detected Gaussian noise in dB, before video
+    # filtering or averaging
+    _log_noise_std = 5.57
+
+    @u.wraps(None, (None, u.hertz, None, None, None, None, None, None, None,
+                    None, None))
+    def plan(self, span, noise_floor=None, signal=None, snr=None,
+             flatness=None, noise_density=-145, k=2.5, min_time=5e-3,
+             overhead=0.05, max_averages=1000):
+        """
+        Chooses the resolution bandwidth, video bandwidth, sweep time and
+        number of averages that meet the requested noise performance in the
+        least total acquisition time.
+
+        The sweep time of a swept analyzer is
+        :math:`T = k \\cdot \\mathrm{span} / (\\mathrm{RBW} \\cdot
+        \\min(\\mathrm{RBW}, \\mathrm{VBW}))`, and the displayed noise level
+        rises by 10 dB for every decade of RBW. The trace-to-trace scatter of
+        the noise falls with the square root of both the number of averages
+        and the ratio RBW/VBW. Every available combination is tried, and the
+        fastest one is returned.
+
+        Args:
+            span (Quantity): The frequency span.
+            noise_floor (float, optional): The highest acceptable displayed
+                noise level in dBm.
+            signal (float, optional): The expected signal level in dBm. Used
+                together with ``snr``.
+            snr (float, optional): The required signal to noise ratio in dB.
+            flatness (float, optional): The largest acceptable standard
+                deviation of the displayed noise in dB.
+            noise_density (float): The displayed noise level of the analyzer
+                in a 1 Hz bandwidth in dBm.
+            k (float): The sweep time constant of the resolution filters.
+            min_time (float): The shortest sweep time of the analyzer in
+                seconds.
+            overhead (float): The time in seconds spent between sweeps.
+            max_averages (int): The largest number of averages to consider.
+
+        Returns:
+            MeasurementPlan: The chosen settings and the predicted time.
+        """
+        max_rbw = float('inf')
+        if noise_floor is not None:
+            max_rbw = min(max_rbw, 10**((noise_floor - noise_density) / 10))
+        if snr is not None:
+            if signal is None:
+                raise ValueError("A signal level is needed to meet an SNR")
+            max_rbw = min(
+                max_rbw, 10**((signal - snr - noise_density) / 10))
+
+        smoothing = 1
+        if flatness is not None:
+            smoothing = (self._log_noise_std / flatness)**2
+
+        best = None
+        for rbw in self._bandwidth_list:
+            if rbw > max_rbw:
+                break
+            # A VBW wider than the RBW neither smooths nor speeds the sweep
+            for vbw in self._bandwidth_list:
+                if vbw > rbw:
+                    break
+                averages = max(1, math.ceil(smoothing * vbw / rbw))
+                if averages > max_averages:
+                    continue
+                sweep_time = max(k * span / (rbw * vbw), min_time)
+                total = averages * (sweep_time + overhead)
+                if best is None or total < best.predicted_time:
+                    best = MeasurementPlan(
+                        span, rbw, vbw, sweep_time, averages, total)
+
+        if best is None:
+            raise ValueError("No combination of settings meets the target")
+        return best
+
+    def apply_plan(self, plan):
+        """
+        Applies the settings of a :class:`MeasurementPlan` in a single write.
+        The sweep mode is left unchanged.
+        """
+        self.inst.write(
+            'FREQ:SPAN %s;:BAND %s;:BAND:VID %s;'
+            ':SWEEP:TIME %s;:AVER:COUNT %i;:AVER:STAT %s'
+            % (plan.span, plan.rbw, plan.vbw, plan.time, plan.averages,
+               'ON' if plan.averages > 1 else 'OFF'))
+        self._freqs = None
+        self.logger.info(
+            "Applied measurement plan: span %s Hz, RBW %s Hz, VBW %s Hz, "
+            "sweep time %s seconds, %i averages."
+            % (plan.span, plan.rbw, plan.vbw, plan.time, plan.averages))
+
+    def run_plan(self, plan):
+        """
+        Applies a :class:`MeasurementPlan`, and times the sweeps it requires.
+        The sweeps are run in single sweep mode, and continuous sweeping is
+        resumed afterwards if it was on.
+
+        Returns:
+            tuple: The predicted and measured acquisition times.
+        """
+        self.apply_plan(plan)
+
+        with self.single_sweep_mode(2 * plan.predicted_time + 10):
+            start = time.monotonic()
+            self.sweep()
+            measured = time.monotonic() - start
+
+        self.logger.info(
+            "Predicted acquisition time %f seconds, measured %f seconds."
+            % (plan.predicted_time, measured))
+        return plan.predicted_time * u.second, measured * u.second
+
+    def _marker_position(self, command, marker):
+        # Run a marker search and read the result back in a single query
+        response = self.inst.query(
+            'CALC:MARK%i ON;:CALC:MARK%i:%s;:CALC:MARK%i:X?;:CALC:MARK%i:Y?'
+            % (marker, marker, command, marker, marker))
+        x, y = response.split(';')
+        return float(x) * u.hertz, float(y)
+
+    def peak(self, marker=1):
+        """
+        Moves a marker to the highest point of the trace.
+
+        The search runs on the analyzer, and only the marker position is
+        transferred, which is much faster than :meth:`acquire` for tracking a
+        single peak.
+
+        Args:
+            marker (int): The marker to use.
+
+        Returns:
+            tuple: The frequency of the peak in Hz and its level in dBm.
+        """
+        return self._marker_position('MAX', marker)
+
+    def next_peak(self, marker=1):
+        """
+        Moves a marker to the next lower peak of the trace.
+
+        Args:
+            marker (int): The marker to use.
+
+        Returns:
+            tuple: The frequency of the peak in Hz and its level in dBm.
+        """
+        return self._marker_position('MAX:NEXT', marker)
+
+    @u.wraps(None, (None, u.hertz, None))
+    def noise(self, frequency, marker=1):
+        """
+        Measures the noise power density with a noise marker. The noise
+        marker function is switched off again afterwards, so the marker can
+        be reused by :meth:`peak`.
+
+        Args:
+            frequency (float): The frequency at which to measure the noise.
+            marker (int): The marker to use.
+
+        Returns:
+            float: The noise power density in dBm/Hz.
+        """
+        try:
+            return float(self.inst.query(
+                'CALC:MARK%i ON;:CALC:MARK%i:X %s;'
+                ':CALC:MARK%i:FUNC:NOIS ON;:CALC:MARK%i:FUNC:NOIS:RES?'
+                % (marker, marker, str(frequency), marker, marker)))
+        finally:
+            self.inst.write('CALC:MARK%i:FUNC:NOIS OFF' % marker)
+
+    @u.wraps(None, (None, u.hertz))
+    def band_power(self, bandwidth):
+        """
+        Measures the total power in a band around the center frequency with
+        the analyzer's channel power function. The function is switched off
+        again afterwards.
+
+        Args:
+            bandwidth (float): The width of the band.
+
+        Returns:
+            float: The power in the band in dBm.
+        """
+        try:
+            return float(self.inst.query(
+                'CALC:MARK:FUNC:POW:SEL CPOW;:POW:ACH:BWID %s;'
+                ':CALC:MARK:FUNC:POW:RES? CPOW' % str(bandwidth)))
+        finally:
+            self.inst.write('CALC:MARK:FUNC:POW OFF')
+
+    def stitched_sweep(self, start, stop, rbw, points=500, overlap=0.1,
+                       timeout=60):
+        """
+        Measures a wide span at a fine resolution bandwidth by sweeping it in
+        segments, and stitches the segments into a single spectrum.
+
+        The segments come from :func:`plan_segments`. Each finished trace is
+        copied to ``TRACE2`` so that the next segment can be set up and swept
+        while the previous one is transferred, and the transferred traces are
+        stitched into a preallocated array on a worker thread. The segments
+        are swept in single sweep mode, and the start and stop frequencies,
+        resolution bandwidth and sweep mode are restored afterwards.
+
+        Args:
+            start (Quantity): The start frequency.
+            stop (Quantity): The stop frequency.
+            rbw (Quantity): The resolution bandwidth.
+            points (int): The number of points in each trace.
+            overlap (float): The minimum fractional overlap between segments.
+            timeout (float): The maximum time to wait for each segment in
+                seconds.
+
+        Returns:
+            tuple of arrays: The frequencies (Hz) and powers of the stitched
+            spectrum.
+        """
+        rbw = rbw.to('hertz').magnitude
+        segments = plan_segments(
+            start.to('hertz').magnitude, stop.to('hertz').magnitude, rbw,
+            points, overlap)
+
+        offsets = np.cumsum([0] + [seg.hi - seg.lo for seg in segments])
+        freqs = np.empty(offsets[-1])
+        powers = np.empty(offsets[-1], dtype=np.float32)
+        for seg, offset in zip(segments, offsets):
+            freqs[offset:offset + seg.hi - seg.lo] = np.linspace(
+                seg.start, seg.stop, points)[seg.lo:seg.hi]
+
+        def stitch(trace, seg, offset):
+            if len(trace) != points:
+                raise ValueError(
+                    "Trace has %i points, expected %i" % (len(trace), points))
+            powers[offset:offset + seg.hi - seg.lo] = trace[seg.lo:seg.hi]
+
+        _old_start, _old_stop, _old_rbw, _old_auto = self.inst.query(
+            'FREQ:STAR?;:FREQ:STOP?;:BAND?;:BAND:AUTO?').split(';')
+        self.inst.write('BAND %s' % str(rbw))
+
+        with self.single_sweep_mode(timeout):
+            try:
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    futures = []
+                    for i, seg in enumerate(segments):
+                        self.inst.write('FREQ:STAR %s;:FREQ:STOP %s;:INIT'
+                                        % (str(seg.start), str(seg.stop)))
+                        if i:
+                            # Transfer the previous segment during this sweep
+                            trace = self.inst.query_binary_values(
+                                'TRAC? TRACE2', datatype='f',
+                                container=np.array)
+                            futures.append(executor.submit(
+                                stitch, trace, segments[i - 1],
+                                offsets[i - 1]))
+                        self.inst.query('*OPC?')
+                        self.inst.write('TRAC:COPY TRACE2,TRACE1')
+
+                    trace = self.inst.query_binary_values(
+                        'TRAC? TRACE2', datatype='f', container=np.array)
+                    futures.append(executor.submit(
+                        stitch, trace, segments[-1], offsets[-2]))
+
+                    for future in futures:
+                        future.result()
+            finally:
+                restore = 'FREQ:STAR %s;:FREQ:STOP %s;:BAND %s' % (
+                    _old_start.strip(), _old_stop.strip(), _old_rbw.strip())
+                if _old_auto.strip() in ('1', 'ON'):
+                    # Couple the RBW to the span again
+                    restore += ';:BAND:AUTO ON'
+                self.inst.write(restore)
+                self._freqs = None
+
+        self.logger.info(
+            "Stitched %i segments from %s Hz to %s Hz at an RBW of %s Hz."
+            % (len(segments), str(segments[0].start),
+               str(segments[-1].stop), str(rbw)))
+        return freqs * u.hertz, powers
+
+    @property
+    def continuous(self):
+        """bool: Whether the analyzer sweeps continuously rather than once
+        per ``INIT``."""
+        return bool(int(self.inst.query('INIT:CONT?')))
+
+    @continuous.setter
+    def continuous(self, value):
+        self.inst.write('INIT:CONT %s' % ('ON' if value else 'OFF'))
+
+    def sweep_timeout(self):
+        """
+        Returns a time in seconds long enough for one :meth:`sweep`: twice
+        the sweep time, times the number of averaged sweeps if averaging is
+        on, plus 10 seconds.
+        """
+        sweep_time, state, count = self.inst.query(
+            'SWEEP:TIME?;:AVER:STAT?;:AVER:COUNT?').split(';')
+        sweeps = int(count) if state.strip() in ('1', 'ON') else 1
+        return 2 * float(sweep_time) * sweeps + 10
+
+    @contextmanager
+    def single_sweep_mode(self, timeout=None):
+        """
+        Puts the analyzer in single sweep mode for the duration of a ``with``
+        block, and resumes continuous sweeping afterwards if it was on.
+
+        The VISA timeout is raised for the block so that :meth:`sweep` can
+        wait for a whole sweep, and restored afterwards.
+
+        Args:
+            timeout (float, optional): The VISA timeout in seconds. Defaults
+                to :meth:`sweep_timeout` for the current settings.
+        """
+        if timeout is None:
+            timeout = self.sweep_timeout()
+        _old_timeout = self.inst.timeout
+        continuous = self.continuous
+        if continuous:
+            self.continuous = False
+        self.inst.timeout = timeout * 1e3
+        try:
+            yield
+        finally:
+            self.inst.timeout = _old_timeout
+            if continuous:
+                self.continuous = True
+
+    def sweep(self):
+        """
+        Starts a single sweep, including every averaged sweep if averaging
+        is on, and waits for it to finish with ``*OPC?``.
+
+        The analyzer must be in single sweep mode, see
+        :meth:`single_sweep_mode`, which also sets a long enough timeout.
+        """
+        self.inst.query('INIT;*OPC?')
+
     """High level commands..."""
-    def acquire(self):
+    def acquire(self, sweep=False):
         """Returns a tuple of the frequencies (Hz) and powers of the trace.
         For the resolution bandwidth, use the ``rbw`` property.
+
+        By default the trace is read as it is, which in continuous sweep mode
+        may be the same trace as the previous call, or a partly updated one.
+        With ``sweep=True`` a fresh single sweep is run and waited for first,
+        and continuous sweeping is resumed after the trace has been read.
+
+        The trace is transferred as a binary ``REAL,32`` block and read into a
+        numpy array with ``numpy.frombuffer``. The frequency axis is cached
+        until the start or stop frequency is changed through this object, so
+        after the first call each trace costs a single query. If the frequency
+        settings are changed from the front panel, call
+        :meth:`clear_frequency_cache`.
+        """
+        if sweep:
+            with self.single_sweep_mode():
+                self.sweep()
+                powers = self.inst.query_binary_values(
+                    'TRAC? TRACE1', datatype='f', container=np.array)
+        else:
+            powers = self.inst.query_binary_values(
+                'TRAC? TRACE1', datatype='f', container=np.array)
+
+        if self._freqs is None or len(self._freqs) != len(powers):
+            self._freqs = np.linspace(
+                self.start.magnitude, self.stop.magnitude,
+                len(powers)) * u.hertz
+
+        return self._freqs, powers
+
+    def clear_frequency_cache(self):
+        """Forces the next :meth:`acquire` to re-read the frequency axis."""
+        self._freqs = None
+
+    def average(self, count=None, background=False):
+        """
+        Averages successive traces on the host with a :class:`TraceAverager`.
+
+        Each trace comes from a fresh single sweep, so ``count`` is the
+        number of independent sweeps averaged. The analyzer stays in single
+        sweep mode until the averaging ends, see :meth:`single_sweep_mode`.
+
+        Args:
+            count (int, optional): The number of traces to average. If not
+                specified, traces are averaged until the averager is stopped.
+                This requires ``background`` to be ``True``.
+            background (bool, optional): If true, traces are acquired in a
+                background thread, and the running statistics can be read
+                from the returned averager while the sweeps continue.
+
+        Returns:
+            TraceAverager: The averager holding the running statistics.
+        """
+        if count is None and not background:
+            raise ValueError(
+                "An unbounded average must be run in the background")
+        averager = TraceAverager(self)
+        if background:
+            averager.start(count)
+        else:
+            averager.run(count)
+        return averager
+
+
+class TraceAverager:
+    """
+    Keeps running statistics of spectrum analyzer traces in fixed memory.
+
+    The mean and variance of each frequency bin are updated with Welford's
+    algorithm, both for the log power as returned by the analyzer (dBm) and
+    for the linear power (mW). The per-bin minimum and maximum of the log
+    power are also kept. Memory use does not grow with the number of traces,
+    and the statistics can be read at any time.
+
+    Parameters:
+        analyzer: An object with a ``single_sweep_mode()`` context manager,
+            a ``sweep()`` method that runs a sweep and waits for it, and an
+            ``acquire()`` method returning a tuple of the frequencies and
+            powers of the trace, e.g. :class:`Rohde_Schwarz_FSEA_20`.
+
+    Attributes:
+        count (int): The number of traces averaged so far.
+        freqs (array): The frequency axis of the averaged traces.
+    """
+    def __init__(self, analyzer=None):
+        self.analyzer = analyzer
+        self.count = 0
+        self.freqs = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._allocate(0)
+
+    def update(self, powers):
+        """
+        Adds a single trace to the running statistics.
+
+        Args:
+            powers (array): The trace in dBm.
+        """
+        powers = np.asarray(powers, dtype=np.float64)
+        with self._lock:
+            if self.count == 0:
+                self._allocate(len(powers))
+            elif len(powers) != len(self._mean):
+                raise ValueError(
+                    "Trace has %i points, expected %i"
+                    % (len(powers), len(self._mean)))
+
+            self.count += 1
+            np.power(10, powers / 10, out=self._linear)
+            self._welford(powers, self._mean, self._m2)
+            self._welford(self._linear, self._mean_linear, self._m2_linear)
+            np.minimum(self._min, powers, out=self._min)
+            np.maximum(self._max, powers, out=self._max)
+
+    def _allocate(self, points):
+        self._mean = np.zeros(points)
+        self._m2 = np.zeros(points)
+        self._mean_linear = np.zeros(points)
+        self._m2_linear = np.zeros(points)
+        self._min = np.full(points, np.inf)
+        self._max = np.full(points, -np.inf)
+        self._linear = np.empty(points)
+        self._delta = np.empty(points)
+
+    def _welford(self, x, mean, m2):
+        # delta = x - mean; mean += delta / n; m2 += delta * (x - mean)
+        np.subtract(x, mean, out=self._delta)
+        mean += self._delta / self.count
+        self._delta *= x - mean
+        m2 += self._delta
+
+    def run(self, count):
         """
-        powers = [float(p) for p in self.inst.query('TRAC? TRACE1').split(',')]
-        freqs = np.linspace(self.start, self.stop, len(powers))
+        Acquires ``count`` traces from the analyzer, each from a new sweep,
+        and adds them to the running statistics.
+        """
+        n = 0
+        with self.analyzer.single_sweep_mode():
+            while ((count is None or n < count)
+                   and not self._stop_event.is_set()):
+                self.analyzer.sweep()
+                freqs, powers = self.analyzer.acquire()
+                self.freqs = freqs
+                self.update(powers)
+                n += 1
+
+    def start(self, count=None):
+        """Runs :meth:`run` in a background thread."""
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run, args=(count,))
+        self._thread.start()
+
+    def stop(self):
+        """Stops the background acquisition after the current trace."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    @property
+    def mean(self):
+        """array: The mean of the log power in dBm."""
+        with self._lock:
+            return self._mean.copy()
 
-        return freqs, powers
+    @property
+    def variance(self):
+        """array: The sample variance of the log power in dB²."""
+        with self._lock:
+            return self._m2 / max(self.count - 1, 1)
+
+    @property
+    def mean_linear(self):
+        """array: The mean of the linear power in mW."""
+        with self._lock:
+            return self._mean_linear.copy()
+
+    @property
+    def variance_linear(self):
+        """array: The sample variance of the linear power in mW²."""
+        with self._lock:
+            return self._m2_linear / max(self.count - 1, 1)
+
+    @property
+    def minimum(self):
+        """array: The smallest power seen in each bin in dBm."""
+        with self._lock:
+            return self._min.copy()
+
+    @property
+    def maximum(self):
+        """array: The largest power seen in each bin in dBm."""
+        with self._lock:
+            return self._max.copy()
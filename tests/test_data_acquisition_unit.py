@@ -0,0 +1,344 @@
+"""Tests for the NI 9215 data acquisition unit."""
+
+import asyncio
+import time
+import numpy
+import pytest
+from hardware import u
+from hardware.data_acquisition_units import MockDAQ
+
+try:
+    from hardware import daq
+except ImportError:
+    # niDAQmx is only available on Windows, so test the simulated DAQ
+    daq = MockDAQ(seed=0)
+
+
+def run(coroutine):
+    # Like asyncio.run, which needs Python 3.7
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+
+def test_read():
+    """Test that a single channel read is one-dimensional and in volts."""
+    data = daq.read(1, rate=100, max_voltage=10)
+    assert data.units == u.volt
+    assert data.shape == (100,)
+
+
+def test_read_channels():
+    """Test that several channels are read into one row each."""
+    data = daq.read(1, rate=100, max_voltage=10, channels=[0, 1])
+    assert data.shape == (2, 100)
+
+    interleaved = daq.read(1, rate=100, max_voltage=10, channels=[0, 1],
+                           interleaved=True)
+    assert interleaved.shape == (2, 100)
+
+    # Only a scalar channel gives one-dimensional data
+    assert daq.read(1, rate=100, max_voltage=10,
+                    channels=numpy.int64(1)).shape == (100,)
+    assert daq.read(1, rate=100, max_voltage=10,
+                    channels=[1]).shape == (1, 100)
+
+
+def test_asynchronous_stop():
+    """Test that stopping an asynchronous read ends the generator."""
+    chunks = daq.read(.1, rate=100, max_voltage=10, asynchronous=True,
+                      overrun='drop-oldest')
+    next(chunks)
+    daq.stop()
+    for _ in chunks:
+        pass
+
+
+def test_stop_blocked():
+    """Test that a callback blocked on a full buffer does not hang stop()."""
+    import threading
+
+    sim = MockDAQ(realtime=False, seed=0)
+    chunks = sim.read(.1, rate=100, asynchronous=True, buffer_chunks=1,
+                      overrun='block')
+    # Let the callback fill the buffer and block on the next chunk
+    next(chunks)
+    time.sleep(.2)
+    stopper = threading.Thread(target=sim.stop, daemon=True)
+    stopper.start()
+    stopper.join(5)
+    assert not stopper.is_alive()
+    for _ in chunks:
+        pass
+
+
+def test_astream():
+    """Test that chunks can be consumed with async for."""
+
+    async def collect():
+        chunks = []
+        stream = daq.astream(rate=100, chunk_seconds=.1, max_voltage=10)
+        async for chunk in stream:
+            chunks.append(chunk)
+            if len(chunks) == 3:
+                break
+        # Closing the stream stops the task
+        await stream.aclose()
+        return chunks
+
+    chunks = run(collect())
+    assert [len(chunk) for chunk in chunks] == [10, 10, 10]
+    assert daq.task is None
+
+
+@pytest.mark.parametrize('overrun', ['drop-oldest', 'error'])
+def test_astream_overrun(overrun):
+    """Test that astream applies and counts the overrun policy like read."""
+    from hardware.data_acquisition_units import BufferOverrunError
+
+    sim = MockDAQ(realtime=False, seed=0)
+
+    async def collect():
+        chunks = []
+        async for chunk in sim.astream(rate=100, chunk_seconds=.1,
+                                       buffer_chunks=2, overrun=overrun):
+            chunks.append(chunk.index)
+            # A slow consumer, which blocks the loop
+            time.sleep(.05)
+            if len(chunks) == 5:
+                break
+        return chunks
+
+    if overrun == 'error':
+        with pytest.raises(BufferOverrunError):
+            run(collect())
+    else:
+        indices = run(collect())
+        # Dropped chunks leave gaps in the sample indices
+        assert indices[-1] > 10 * (len(indices) - 1)
+    assert sim.queue.overruns > 0
+    assert sim.queue.lost == 10 * sim.queue.overruns
+    assert sim.task is None
+
+
+def test_reuse_buffers():
+    """Test that a continuous read stops allocating once it is running."""
+    chunks = daq.read(.1, rate=100, max_voltage=10, asynchronous=True,
+                      reuse_buffers=True)
+    for _ in range(10):
+        next(chunks)
+    daq.stop()
+    assert daq.pool.allocations < 10
+
+
+def test_chunked_read():
+    """Test that a chunked read returns every decimated sample."""
+    data = daq.read(3, rate=100, max_voltage=10, chunk_seconds=.5)
+    assert data.shape == (300,)
+    assert daq.task is None
+
+
+def test_slow_read():
+    """Test that rates below one sample per chunk are still chunked."""
+    sim = MockDAQ(realtime=False, seed=0)
+    data = sim.read(10, rate=.5)
+    assert data.shape == (5,)
+    # One decimated sample per chunk
+    task, = sim._task_cache.values()
+    assert task.sample_size == 10
+
+
+@pytest.mark.parametrize('decimator', ['boxcar', 'cic', 'fir'])
+def test_decimator(decimator):
+    """Test that the decimated data is in volts and the right length."""
+    data = daq.read(1, rate=100, max_voltage=10, decimator=decimator)
+    assert data.units == u.volt
+    assert data.shape == (100,)
+
+
+def test_decimator_state():
+    """Test that decimating in chunks matches decimating all at once."""
+    from hardware.data_acquisition_units import make_decimator
+
+    x = numpy.random.randn(2, 10000)
+    for name in ('boxcar', 'cic', 'fir'):
+        whole = numpy.empty((2, 1000))
+        make_decimator(name, 10)(x, whole)
+
+        chunked = numpy.empty((2, 1000))
+        decimator = make_decimator(name, 10)
+        decimator(x[:, :3000], chunked[:, :300])
+        decimator(x[:, 3000:], chunked[:, 300:])
+        assert numpy.allclose(whole, chunked)
+
+
+def test_simulated_noise():
+    """Test that the simulated white noise matches the ARW."""
+    sim = MockDAQ(seed=1, realtime=False, arw=.01, bias_instability=0,
+                  rate_random_walk=0, scale_factor=1e4)
+    data = sim.read(10, rate=1000, oversampling_ratio=1).magnitude
+    expected = .01 * numpy.sqrt(3600 * 1000) / 1e4
+    assert abs(data.std() / expected - 1) < .05
+
+
+def test_simulated_rotation():
+    """Test that the simulated gyro responds to its rotation."""
+    sim = MockDAQ(seed=1, realtime=False, arw=0, bias_instability=0,
+                  rate_random_walk=0, scale_factor=1e4, rotation=1e4)
+    assert numpy.allclose(sim.read(1, rate=100).magnitude, 1)
+
+    # The simulated time starts again from 0
+    sim.reset()
+    sim.model.rotation = lambda t: 1e4 * (t < 1)
+    data = sim.read(2, rate=100, oversampling_ratio=1).magnitude
+    assert numpy.allclose(data[:100], 1) and numpy.allclose(data[100:], 0)
+
+
+def test_simulated_seed():
+    """Test that a seeded simulation is reproducible."""
+    first = MockDAQ(seed=2, realtime=False).read(1, rate=1000)
+    second = MockDAQ(seed=2, realtime=False).read(1, rate=1000)
+    assert (first == second).all()
+
+
+def test_simulated_throughput():
+    """Test that the simulation sustains at least 1 MS/s."""
+    sim = MockDAQ(seed=3, realtime=False)
+    start = time.perf_counter()
+    sim.read(2, rate=1e5, oversampling_ratio=10, chunk_seconds=.5)
+    assert 2e6 / (time.perf_counter() - start) > 1e6
+
+
+def test_latency():
+    """Test that a latency target shortens chunks and callbacks."""
+    start = time.monotonic()
+    chunks = daq.read(1, rate=100, max_voltage=10, asynchronous=True,
+                      latency=.05)
+    chunk = next(chunks)
+    delay = time.monotonic() - start
+    daq.stop()
+    assert len(chunk) == 5
+    assert delay < .5
+
+
+def test_callback_seconds():
+    """Test that chunks are assembled from several callbacks."""
+    chunks = daq.read(.5, rate=100, max_voltage=10, asynchronous=True,
+                      callback_seconds=.1)
+    assert daq.task.sample_size == 100
+    assert len(next(chunks)) == 50
+    daq.stop()
+
+
+@pytest.mark.parametrize('rate', [333.33, 83.33, 45])
+def test_stream_buffer_size(rate):
+    """Test that the device buffer is a whole number of callbacks."""
+    from hardware.data_acquisition_units import _stream_sizes
+
+    sample_size, block_size, buffer_size = _stream_sizes(rate, 10, 1)
+    assert buffer_size % sample_size == 0
+    assert buffer_size >= rate * 10
+
+    # The simulated device rejects other buffer sizes, like DAQmx
+    sim = MockDAQ(seed=0, realtime=False)
+    chunks = sim.read(1, rate=rate, asynchronous=True)
+    next(chunks)
+    sim.stop()
+
+
+def test_chunk_timestamps():
+    """Test that chunks record their first sample and when they arrived."""
+    chunks = daq.read(.1, rate=100, max_voltage=10, asynchronous=True)
+    first, second = next(chunks), next(chunks)
+    daq.stop()
+    assert (first.index, second.index) == (0, 10)
+    assert first.timestamp < second.timestamp
+    # The last sample of a chunk had been acquired by its timestamp
+    assert second.times()[-1] <= second.timestamp + .01
+    assert numpy.allclose(daq.clock.index(second.times()), range(10, 20))
+
+
+def test_clock_drift():
+    """Test that the clock model measures a fast sample clock."""
+    sim = MockDAQ(seed=4, clock_error=.05)
+    chunks = sim.read(.1, rate=100, max_voltage=10, asynchronous=True,
+                      callback_seconds=.05)
+    for _ in range(10):
+        next(chunks)
+    sim.stop()
+    assert abs(sim.clock.rate / 1050 - 1) < .01
+
+
+def test_task_cache():
+    """Test that repeated reads reuse one committed task."""
+    sim = MockDAQ(seed=5, realtime=False, task_cache_size=2)
+    sim.read(1, rate=100, decimator='fir')
+    task = sim._task_cache[next(iter(sim._task_cache))]
+    assert task.committed
+    clock = sim.clock
+
+    sim.read(1, rate=100, decimator='fir')
+    assert list(sim._task_cache.values()) == [task]
+    # The task starts afresh, rather than from the previous read
+    assert sim.clock is not clock and sim.clock.count == 1
+
+    sim.read(1, rate=200)
+    sim.read(1, rate=300)
+    assert len(sim._task_cache) == 2
+    sim.clear_tasks()
+    assert not sim._task_cache
+
+
+def test_task_reservation():
+    """Test that cached tasks release the device to other tasks."""
+
+    sim = MockDAQ(seed=7, realtime=False)
+    sim.read(.1, rate=100)
+    # The simulated device, like DAQmx, refuses a second reservation
+    with pytest.raises(RuntimeError):
+        MockDAQ.FOG_DAQ_Task(sim, .1, 200, 10, 10, False)
+
+    # Reads with other settings, asynchronous reads and streams unreserve
+    # the cached task
+    sim.read(.1, rate=200)
+    sim.read(.1, rate=100)
+    chunks = sim.read(.1, rate=100, asynchronous=True)
+    next(chunks)
+    sim.stop()
+
+    async def stream():
+        stream = sim.astream(rate=100, chunk_seconds=.1)
+        chunk = await stream.__anext__()
+        await stream.aclose()
+        return chunk
+
+    assert run(stream()).shape == (10,)
+    sim.read(.1, rate=100)
+    slow, fast = sim._task_cache.values()
+    assert fast.committed and not slow.committed
+    sim.clear_tasks()
+    assert sim._reservation is None
+
+
+def test_trigger():
+    """Test that a triggered read starts at the trigger edge."""
+    sim = MockDAQ(seed=6, trigger_delay=.3)
+    start = time.monotonic()
+    data = sim.read(.1, rate=100, trigger='/SimDev1/PFI0')
+    assert time.monotonic() - start > .35
+    assert data.shape == (10,)
+    assert abs(sim.clock.time(0) - (start + .3)) < .05
+
+
+def test_pretrigger():
+    """Test that a reference trigger keeps the samples before the edge."""
+    sim = MockDAQ(seed=6, trigger_delay=.3)
+    start = time.monotonic()
+    data = sim.read(.1, rate=100, trigger='/SimDev1/PFI0',
+                    pretrigger_seconds=.05, chunk_seconds=.05)
+    assert data.shape == (15,)
+    assert sim.trigger_index == 5
+    assert abs(sim.clock.time(sim.trigger_index) - (start + .3)) < .05
@@ -1,7 +1,10 @@
 """A set of functions that test the LIA."""
 import pytest
+import time
+import numpy as np
 try:
     from hardware import Q_, u, log_filename, lia
+    from hardware.lock_in_amplifiers import Autoranger
 except ImportError:
     pytestmark = pytest.mark.skip
 
@@ -64,3 +67,87 @@ def test_time_constant():
 
     # Restore
     lia.time_constant = start_time_constant
+
+
+def test_snap():
+    """Test that SNAP? returns the requested parameters by name."""
+    snap = lia.snap('x', 'y', 'frequency')
+    assert snap._fields == ('x', 'y', 'frequency')
+    x, y = lia.snap()
+
+    with pytest.raises(ValueError):
+        lia.snap('x')
+
+
+def test_buffered_read():
+    """Test that the internal buffer returns the requested number of points."""
+    start_sample_rate = lia.sample_rate
+    ch1, ch2 = lia.buffered_read(2 * u.second, 64 * u.hertz)
+    assert ch1.shape == ch2.shape == (128,)
+    for data in (ch1, ch2):
+        # Displays in dBm are returned without units
+        assert not hasattr(data, 'units') or data.units in (u.volt, u.degree)
+
+    # Restore
+    lia.sample_rate = start_sample_rate
+
+
+def test_autogain():
+    """Test that autogain returns once the lock-in is idle."""
+    start_sensitivity = lia.sensitivity
+    lia.autogain()
+    assert lia.inst.read_stb() & 0b10
+
+    # Restore
+    lia.sensitivity = start_sensitivity
+
+
+def test_snap_to_nearest():
+    """Test that invalid sensitivities snap to the nearest valid one."""
+    start_sensitivity = lia.sensitivity
+    lia.snap_to_nearest = True
+    try:
+        lia.sensitivity = Q_(.25, 'volt')
+        assert lia.sensitivity == Q_(.3, 'volt')
+    finally:
+        lia.snap_to_nearest = False
+
+    # Restore
+    lia.sensitivity = start_sensitivity
+
+
+def test_monitor():
+    """Test that the status monitor records the initial status."""
+    status_monitor = lia.monitor(period=.1)
+    time.sleep(.5)
+    status_monitor.stop()
+    assert len(status_monitor.times) >= 1
+    assert len(status_monitor.mask([time.monotonic()])) == 1
+
+
+def test_settle_time():
+    """Test that the settle time scales with the time constant."""
+    start_time_constant = lia.time_constant
+    lia.time_constant = 10e-3 * u.second
+    short = lia.settle_time()
+    lia.time_constant = 100e-3 * u.second
+    assert short.units == "second"
+    assert lia.settle_time() > 9 * short
+
+    # Restore
+    lia.time_constant = start_time_constant
+
+
+def test_autoranger():
+    """Test that the autoranger steps up on a near-full-scale chunk."""
+    start_sensitivity = lia.sensitivity
+    lia.sensitivity = Q_(.01, 'volt')
+    try:
+        autoranger = Autoranger(lia, rate=100)
+        data, tags = autoranger.update(np.full((2, 100), .0095))
+        assert not tags.any()
+        assert lia.sensitivity == Q_(.03, 'volt')
+        assert len(autoranger.changes) == 1
+    finally:
+        # Restore
+        lia.sensitivity = start_sensitivity
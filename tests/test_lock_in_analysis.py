@@ -0,0 +1,163 @@
+"""Tests for the lock-in amplifier helpers that need no hardware."""
+
+import logging
+import math
+import time
+
+import numpy as np
+import pytest
+import visa
+
+from hardware import u
+from hardware.lock_in_amplifiers import (
+    Autoranger, SRS_SR844, StatusMonitor, _lookup, _settle_factor)
+
+
+class FakeLockIn:
+    """
+    Answers LIAS? queries from a list, raising any exceptions in it, and
+    then repeats the last answer. Also keeps a sensitivity for the
+    Autoranger.
+    """
+    _status_dictionary = {
+        0: {"name": "ULK"}, 4: {"name": "INP"}, 6: {"name": "FLT"},
+        8: {"name": "CH1"}}
+    _sensitivity_list = SRS_SR844._sensitivity_list
+    _sensitivity_index = SRS_SR844._sensitivity_index
+
+    def __init__(self, responses=(), sensitivity=10e-3):
+        self.responses = list(responses)
+        self.last = '0'
+        self.sensitivity = sensitivity * u.volt
+        self.logger = logging.getLogger(__name__)
+
+    def settle_time(self, fraction=1e-3):
+        return 100e-3 * u.second
+
+    def _query(self, command):
+        assert command == 'LIAS?'
+        response = self.responses.pop(0) if self.responses else self.last
+        if isinstance(response, Exception):
+            raise response
+        self.last = response
+        return response
+
+
+@pytest.mark.parametrize('val, key', [
+    (100e-9, 0), (1e-3, 8), (1, 14),
+    (1e-3 * (1 + 1e-12), 8),
+])
+def test_lookup_exact(val, key):
+    """Test that valid settings are found with or without snapping."""
+    for snap in (False, True):
+        assert _lookup(SRS_SR844._sensitivity_list,
+                       SRS_SR844._sensitivity_index, val, snap, "") == key
+
+
+@pytest.mark.parametrize('val, key', [
+    (.25, 13), (.15, 12), (.2, 13), (1e-12, 0), (0, 0), (-1, 0), (5, 14),
+])
+def test_lookup_snap(val, key):
+    """Test that other values snap to the nearest setting by ratio."""
+    assert _lookup(SRS_SR844._sensitivity_list,
+                   SRS_SR844._sensitivity_index, val, True, "") == key
+
+
+def test_lookup_invalid():
+    """Test that values between settings are rejected without snapping."""
+    with pytest.raises(ValueError, match="Not a valid sensitivity"):
+        _lookup(SRS_SR844._sensitivity_list, SRS_SR844._sensitivity_index,
+                .25, False, "Not a valid sensitivity")
+
+
+def test_mask():
+    """Test that samples are masked around a reported overload."""
+    monitor = StatusMonitor(FakeLockIn(), period=1)
+    monitor._record(10, 0)
+    monitor._record(12, 1 << 4)  # INP
+    monitor._record(13, 1 << 8)  # CH1 only
+    monitor._record(15, 0)
+
+    times = np.array([5, 10.5, 11.5, 12.5, 13.5, 14.5, 15.5])
+    assert monitor.status_at(times).tolist() == [0, 0, 0, 16, 256, 256, 0]
+    # The poll at 12 may report an overload that started after 11
+    assert monitor.mask(times).tolist() == [
+        False, False, True, True, False, False, False]
+    assert monitor.mask(times, names=('CH1',)).tolist() == [
+        False, False, False, True, True, True, False]
+
+
+def test_monitor_error():
+    """Test that a failed poll is logged and polling continues."""
+    error = visa.VisaIOError(-1073807339)
+    lia = FakeLockIn(['0', error, '16'])
+    monitor = StatusMonitor(lia, period=.01)
+    monitor.start()
+    deadline = time.monotonic() + 5
+    while len(monitor.status) < 2 and time.monotonic() < deadline:
+        time.sleep(.01)
+    monitor.stop()
+    assert monitor.error is error
+    assert monitor.status.tolist() == [0, 16]
+
+
+@pytest.mark.parametrize('poles', [1, 2, 3, 4])
+@pytest.mark.parametrize('fraction', [1e-2, 1e-3, 1e-6])
+def test_settle_factor(poles, fraction):
+    """Test that the step response has settled to the fraction."""
+    x = _settle_factor(poles, fraction)
+    residual = math.exp(-x) * sum(x**k / math.factorial(k)
+                                  for k in range(poles))
+    assert residual == pytest.approx(fraction, rel=1e-6)
+    if poles == 1:
+        assert x == pytest.approx(-math.log(fraction))
+
+
+def test_settle_time():
+    """Test that the settle time uses the cached time constant and slope."""
+    # Without an instrument, the cached settings must not be queried
+    lia = object.__new__(SRS_SR844)
+    lia._time_constant = 10e-3
+    lia._filter_slope = 0
+    single = lia.settle_time(1e-3)
+    assert single.units == u.second
+    assert single.magnitude == pytest.approx(-math.log(1e-3) * 10e-3)
+    lia._filter_slope = 24
+    assert lia.settle_time(1e-3).magnitude == pytest.approx(
+        _settle_factor(4, 1e-3) * 10e-3)
+
+
+def test_autoranger_up():
+    """Test that a near-full-scale chunk steps the range up."""
+    lia = FakeLockIn(sensitivity=10e-3)
+    autoranger = Autoranger(lia, rate=100)
+    data, tags = autoranger.update(np.full((2, 100), 9.5e-3))
+    assert not tags.any()
+    assert np.allclose(data, 9.5e-3)
+    assert lia.sensitivity == 30e-3 * u.volt
+    assert autoranger.changes == [(100, 10e-3, 30e-3)]
+
+    # The next chunk is rescaled, and tagged while the output settles
+    data, tags = autoranger.update(np.full(50, 1e-3))
+    assert np.allclose(data, 3e-3)
+    assert tags.tolist() == [True] * 10 + [False] * 40
+
+
+def test_autoranger_down():
+    """Test that a small chunk steps the range down, with hysteresis."""
+    lia = FakeLockIn(sensitivity=30e-3)
+    autoranger = Autoranger(lia, rate=100)
+    # Above half of the next lower full scale, the range is kept
+    autoranger.update(np.full(10, 6e-3))
+    assert lia.sensitivity == 30e-3 * u.volt
+    autoranger.update(np.full(10, 4e-3))
+    assert lia.sensitivity == 10e-3 * u.volt
+    assert autoranger.changes == [(20, 30e-3, 10e-3)]
+
+
+def test_autoranger_clipping():
+    """Test that clipped samples are tagged."""
+    autoranger = Autoranger(FakeLockIn(sensitivity=1), rate=100)
+    data, tags = autoranger.update(np.array([[.5, 1, -1.2], [0, 0, 0]]))
+    assert tags.tolist() == [False, True, True]
+    assert autoranger.full_scale == 1
@@ -0,0 +1,34 @@
+"""Tests for the ANDO_AQ6317B optical spectrum analyzer."""
+
+import pytest
+
+try:
+    from hardware import osa
+except ImportError:
+    # optical spectrum analyzer not connected
+    pytestmark = pytest.mark.skip
+
+
+def test_single_sweep():
+    """Test that a single sweep finishes and leaves the OSA stopped."""
+    osa.single_sweep()
+    osa.wait_for_sweep(timeout=120)
+    assert osa.sweep_status == 0
+
+
+def test_spectra():
+    """Test that the spectra generator yields fresh, complete spectra."""
+    spectra = list(osa.spectra(count=2, timeout=120))
+    assert len(spectra) == 2
+    for wavelength, power in spectra:
+        assert len(wavelength) == len(power)
+
+
+def test_get_spectra():
+    """Test that get_spectra matches the traces read one at a time."""
+    spectra = osa.get_spectra('ABC')
+    assert spectra.shape[0] == 4
+
+    wavelength, power = osa.get_spectrum('B')
+    assert (spectra[0] == wavelength).all()
+    assert (spectra[2] == power).all()
@@ -0,0 +1,167 @@
+"""Tests for the spectrum analyzer helpers that need no hardware."""
+
+import logging
+from contextlib import contextmanager
+
+import numpy as np
+import pytest
+
+from hardware import u
+from hardware.spectrum_analyzers import (
+    Rohde_Schwarz_FSEA_20, TraceAverager, plan_segments)
+
+
+class FakeAnalyzer:
+    """Returns a new random trace for every sweep."""
+    def __init__(self, points=101, seed=0):
+        self.freqs = np.linspace(1e6, 2e6, points)
+        self.rng = np.random.default_rng(seed)
+        self.traces = []
+        self.single = False
+        self.swept = False
+
+    @contextmanager
+    def single_sweep_mode(self):
+        self.single = True
+        yield
+        self.single = False
+
+    def sweep(self):
+        assert self.single
+        self.swept = True
+
+    def acquire(self):
+        assert self.swept, "Traces must come from a fresh sweep"
+        self.swept = False
+        powers = self.rng.normal(-80, 3, len(self.freqs))
+        self.traces.append(powers)
+        return self.freqs, powers
+
+
+class FakeInstrument:
+    """Answers queries from a dict, and records writes."""
+    def __init__(self, responses):
+        self.responses = responses
+        self.writes = []
+        self.timeout = 2e3
+
+    def query(self, command):
+        return self.responses[command]
+
+    def write(self, command):
+        self.writes.append(command)
+
+
+def test_single_sweep_mode():
+    """Test that the sweep mode and timeout are set and restored."""
+    rfsa = object.__new__(Rohde_Schwarz_FSEA_20)
+    rfsa.inst = FakeInstrument({
+        'INIT:CONT?': '1',
+        'SWEEP:TIME?;:AVER:STAT?;:AVER:COUNT?': '2.5;1;4'})
+    with pytest.raises(RuntimeError):
+        with rfsa.single_sweep_mode():
+            # Four averaged sweeps of 2.5 s, with a margin
+            assert rfsa.inst.timeout == 30e3
+            assert rfsa.inst.writes == ['INIT:CONT OFF']
+            raise RuntimeError
+    assert rfsa.inst.timeout == 2e3
+    assert rfsa.inst.writes == ['INIT:CONT OFF', 'INIT:CONT ON']
+
+
+def test_marker_functions_off():
+    """Test that the noise and channel power functions are switched off."""
+    rfsa = object.__new__(Rohde_Schwarz_FSEA_20)
+    rfsa.inst = FakeInstrument({})
+    rfsa.inst.query = lambda command: '-150.5'
+    assert rfsa.noise(1 * u.megahertz, marker=2) == -150.5
+    assert rfsa.band_power(10 * u.kilohertz) == -150.5
+    assert rfsa.inst.writes == [
+        'CALC:MARK2:FUNC:NOIS OFF', 'CALC:MARK:FUNC:POW OFF']
+
+
+def test_stitched_sweep_restores():
+    """Test that a stitched sweep restores the frequencies and RBW."""
+    rfsa = object.__new__(Rohde_Schwarz_FSEA_20)
+    rfsa.logger = logging.getLogger(__name__)
+    rfsa.inst = FakeInstrument({
+        'INIT:CONT?': '0', '*OPC?': '1',
+        'FREQ:STAR?;:FREQ:STOP?;:BAND?;:BAND:AUTO?': '1E6;2E6;3E3;1'})
+    rfsa.inst.query_binary_values = (
+        lambda command, datatype, container: np.zeros(101, dtype='f'))
+    freqs, powers = rfsa.stitched_sweep(
+        1 * u.megahertz, 1.2 * u.megahertz, 1 * u.kilohertz, points=101)
+    assert len(freqs) == len(powers) == 401
+    assert rfsa.inst.writes[-1] == (
+        'FREQ:STAR 1E6;:FREQ:STOP 2E6;:BAND 3E3;:BAND:AUTO ON')
+    assert rfsa.inst.timeout == 2e3
+
+
+def test_update():
+    """Test that the running statistics match numpy on the stored traces."""
+    rng = np.random.default_rng(1)
+    traces = rng.normal(-60, 2, (20, 50))
+    averager = TraceAverager()
+    for trace in traces:
+        averager.update(trace)
+
+    linear = 10**(traces / 10)
+    assert averager.count == 20
+    assert np.allclose(averager.mean, traces.mean(axis=0))
+    assert np.allclose(averager.variance, traces.var(axis=0, ddof=1))
+    assert np.allclose(averager.mean_linear, linear.mean(axis=0))
+    assert np.allclose(averager.variance_linear, linear.var(axis=0, ddof=1))
+    assert np.array_equal(averager.minimum, traces.min(axis=0))
+    assert np.array_equal(averager.maximum, traces.max(axis=0))
+
+
+def test_update_length():
+    """Test that a trace of a different length is rejected."""
+    averager = TraceAverager()
+    averager.update(np.zeros(10))
+    with pytest.raises(ValueError):
+        averager.update(np.zeros(11))
+
+
+def test_run():
+    """Test that every averaged trace comes from its own sweep."""
+    analyzer = FakeAnalyzer()
+    averager = TraceAverager(analyzer)
+    averager.run(5)
+    assert averager.count == len(analyzer.traces) == 5
+    assert not analyzer.single
+    assert averager.freqs is analyzer.freqs
+    assert np.allclose(averager.mean, np.mean(analyzer.traces, axis=0))
+
+
+def test_plan():
+    """Test that the planner converts the span and meets the noise floor."""
+    # The planner only needs the bandwidth tables, not an instrument
+    rfsa = object.__new__(Rohde_Schwarz_FSEA_20)
+    plan = rfsa.plan(1 * u.megahertz, noise_floor=-90, flatness=1)
+    assert plan == rfsa.plan(1000 * u.kilohertz, noise_floor=-90, flatness=1)
+    assert plan.span == 1e6
+    assert -145 + 10 * np.log10(plan.rbw) <= -90
+    assert plan.predicted_time == pytest.approx(
+        plan.averages * (plan.time + 0.05))
+
+
+@pytest.mark.parametrize('start, stop, rbw, points, overlap', [
+    (1e6, 2.5e6, 1e3, 500, 0.1),
+    (10e6, 20e6, 10e3, 500, 0.1),
+    (0, 1e5, 3, 101, 0.3),
+    (1e6, 1.2e6, 1e3, 500, 0.1),
+])
+def test_plan_segments(start, stop, rbw, points, overlap):
+    """Test that stitched segments are evenly spaced at the resolution."""
+    segments = plan_segments(start, stop, rbw, points, overlap)
+    freqs = np.concatenate([
+        np.linspace(seg.start, seg.stop, points)[seg.lo:seg.hi]
+        for seg in segments])
+    spacing = np.diff(freqs)
+    assert freqs[0] == start
+    assert freqs[-1] == stop
+    assert spacing.max() <= rbw / 2 * (1 + 1e-9)
+    assert spacing.min() >= spacing.max() * (1 - 1e-6)
+    for previous, seg in zip(segments, segments[1:]):
+        width = seg.stop - seg.start
+        assert previous.stop - seg.start >= overlap * width * (1 - 1e-9)
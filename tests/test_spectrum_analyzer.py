@@ -101,3 +101,60 @@ def test_time():
 
     # return to initial condition
     rfsa.time = time
+
+
+def test_acquire():
+    """Test that the binary trace and cached frequency axis line up."""
+    freqs, powers = rfsa.acquire()
+    assert freqs.units == u.hertz
+    assert len(freqs) == len(powers)
+    assert freqs[0] == rfsa.start
+    assert freqs[-1] == rfsa.stop
+
+    # A second acquisition reuses the cached axis
+    freqs2, _ = rfsa.acquire()
+    assert freqs2 is freqs
+
+
+def test_average():
+    """Test that the running average has one value per frequency bin."""
+    averager = rfsa.average(count=3)
+    assert averager.count == 3
+    assert len(averager.mean) == len(averager.freqs)
+    assert (averager.minimum <= averager.mean).all()
+    assert (averager.mean <= averager.maximum).all()
+
+
+def test_run_plan():
+    """Test that a measurement plan is applied and timed."""
+    span = rfsa.span
+    plan = rfsa.plan(1 * u.megahertz, noise_floor=-90)
+    predicted, measured = rfsa.run_plan(plan)
+    assert predicted.units == u.second
+    assert measured.units == u.second
+    assert rfsa.rbw.magnitude == plan.rbw
+
+    rfsa.span = span
+
+
+def test_peak():
+    """Test that the peak marker agrees with the full trace."""
+    freqs, powers = rfsa.acquire()
+    frequency, level = rfsa.peak()
+    assert frequency.units == u.hertz
+    assert rfsa.start <= frequency <= rfsa.stop
+    assert level <= max(powers) + 1
+
+
+def test_stitched_sweep():
+    """Test that a stitched sweep covers the span in increasing frequency."""
+    start, stop, rbw = rfsa.start, rfsa.stop, rfsa.rbw
+    freqs, powers = rfsa.stitched_sweep(
+        10 * u.megahertz, 20 * u.megahertz, 10 * u.kilohertz)
+    assert len(freqs) == len(powers)
+    assert freqs[0] == 10 * u.megahertz
+    assert freqs[-1] == 20 * u.megahertz
+    assert (freqs[1:] > freqs[:-1]).all()
+
+    # The settings are restored
+    assert (rfsa.start, rfsa.stop, rfsa.rbw) == (start, stop, rbw)